@@ -0,0 +1,49 @@
+"""
+Микробенчмарк смены частоты ШИМ на компьютере.
+Сравнивает прежний путь (полная переинициализация PWM, как было в frequency)
+с перенастройкой предделителя и периода через PWM.frequency.
+Запуск из корня репозитория: python -m bench.pwm_frequency
+"""
+import sim
+
+sim.install()
+
+from time import perf_counter_ns
+
+from pwm import PWM, timers
+
+# Частоты нот первой и второй октав, как их выдаёт BuzzerPlayer
+NOTES = (262, 294, 330, 349, 392, 440, 494, 523, 587, 659, 698, 784, 880, 988)
+ROUNDS = 2000
+
+
+def measure(fn):
+    """
+    Возвращает среднее время одного вызова fn(hz) в микросекундах.
+    """
+    start = perf_counter_ns()
+    for _ in range(ROUNDS):
+        for hz in NOTES:
+            fn(hz)
+    return (perf_counter_ns() - start) / (ROUNDS * len(NOTES)) / 1000
+
+
+def main():
+    p = PWM('P8', freq=10000, width=0)
+    p.duty(30)
+
+    inits = timers.inits
+    before = measure(lambda hz: p.__init__(p.pin, hz, p.width))
+    before_inits = timers.inits - inits
+
+    inits = timers.inits
+    after = measure(p.frequency)
+    after_inits = timers.inits - inits
+
+    print('reinit PWM:      {:8.2f} us/call, timer inits: {}'.format(before, before_inits))
+    print('PWM.frequency:   {:8.2f} us/call, timer inits: {}'.format(after, after_inits))
+    print('speedup:         {:8.1f}x'.format(before / after))
+
+
+if __name__ == '__main__':
+    main()
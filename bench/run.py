@@ -0,0 +1,533 @@
+"""
+Бенчмарки горячих путей драйверов на эмуляторе платы.
+Для каждого вызова измеряется время и объём памяти, выделяемой за вызов.
+Результаты выводятся в JSON и сравниваются с сохранённой базой:
+если путь стал медленнее или выделяет больше памяти, код возврата 1.
+
+Запуск из корня репозитория:
+    python -m bench.run                  # сравнить с bench/baseline.json
+    python -m bench.run --save           # перезаписать базу
+    python -m bench.run -o result.json   # сохранить результаты в файл
+"""
+import sim
+
+sim.install()
+
+import argparse
+import atexit
+import gc
+import json
+import os
+import struct
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter_ns
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+MIN_TIME_NS = 20000000  # минимальная длительность одного замера
+REPEAT = 7
+
+
+# --- сценарии: каждый возвращает функцию без аргументов ---
+
+def case_pwm_duty():
+    from pwm import PWM
+    p = PWM('A0')
+    return lambda: p.duty(42.5)
+
+
+def case_pwm_duty_u16():
+    from pwm import PWM
+    p = PWM('A0')
+    return lambda: p.duty_u16(27853)
+
+
+def case_pwm_duty_ticks():
+    from pwm import PWM
+    p = PWM('A0')
+    return lambda: p.duty_ticks(71400)
+
+
+def case_motor_forward():
+    from motors2wd import Motors2WD
+    m = Motors2WD()
+    return lambda: m.M1.forward(80)
+
+
+def case_motors2wd_left():
+    from motors2wd import Motors2WD
+    m = Motors2WD()
+    # Без регистров TIMx_CCRn: на компьютере каждое обращение к stm - вызов
+    # Python, поэтому здесь меряется только код драйвера, а путь через
+    # регистры - в отдельном сценарии ниже
+    m._group._cr1 = None
+    return lambda: m.left(60)
+
+
+def case_motors2wd_left_registers():
+    from motors2wd import Motors2WD
+    m = Motors2WD()
+    return lambda: m.left(60)
+
+
+def case_full_robot_tone():
+    from buzzer import BuzzerPlayer
+    from led import LEDpwm
+    from motors2wd import Motors2WD
+    # Моторы, пищалка и светодиод делят таймер 3: пищалка и светодиод
+    # получают его частоту, а ноты перенастраивают таймер для всех
+    m = Motors2WD()
+    player = BuzzerPlayer()
+    light = LEDpwm('P9')
+    m.forward(60)
+    light.brightness(50)
+    notes = (440, 880)
+    state = [0]
+
+    def tone():
+        i = state[0] ^ 1
+        state[0] = i
+        player.tone(notes[i])
+    return tone
+
+
+def case_led_bank_pattern():
+    from led import LEDBank
+    bank = LEDBank('P8', 'P9', 'P10', 'P11')
+    return lambda: bank.pattern(0b0101)
+
+
+def case_led_bank_rotate():
+    from led import LEDBank
+    bank = LEDBank('P8', 'P9', 'P10', 'P11')
+    bank.pattern(1)
+    return bank.rotate
+
+
+def case_ledpwm_brightness():
+    from led import LEDpwm
+    light = LEDpwm('LED1')
+    return lambda: light.brightness(37)
+
+
+def case_ledmux_tick():
+    from led import LED, LEDMux
+    mux = LEDMux()
+    pins = ('P0', 'P1', 'P2', 'P3', 'P4', 'P7', 'P8', 'P9', 'P10', 'P11', 'P12', 'P13')
+    for i, pin in enumerate(pins):
+        if i % 2:
+            mux.blink(LED(pin), 200 + i * 10)
+        else:
+            mux.dim(LED(pin), i * 8)
+    return lambda: mux._tick(None)
+
+
+def case_motors2wd_reverse():
+    from motors2wd import Motors2WD
+    m = Motors2WD()
+    return m.reverse_motors
+
+
+def case_motors2wd_drive_tick():
+    from motors2wd import Motors2WD
+    m = Motors2WD()
+    m.drive(80, 20)
+
+    def tick():
+        if m._speed[0] == m._target[0]:
+            m.drive(-m._target[0] * 100 // 0xffff, 20)
+        m._drive_tick(None)
+    return tick
+
+
+def case_speed_control_tick():
+    from motors2wd import Motors2WD, Encoder, SpeedControl
+    m = Motors2WD()
+    m.M1.encoder = Encoder('P2', 'P3')
+    m.M2.encoder = Encoder('P8')
+    ctl = SpeedControl(m.M1, m.M2)
+    ctl.set_rpm(150, -90)
+    counts = m.M1.encoder._count
+
+    def tick():
+        counts[0] += 1
+        ctl._tick(None)
+    return tick
+
+
+def case_motion_queue_tick():
+    from motors2wd import Motors2WD, MotionQueue
+    q = MotionQueue(Motors2WD())
+
+    def tick():
+        if not len(q):
+            q.forward(80, ms=50)
+            q.left(50, ms=20)
+        q._tick(None)
+    return tick
+
+
+def case_servo_set_angle():
+    from servo import ServoFS90
+    s = ServoFS90('A1')
+    return lambda: s.set_angle(135)
+
+
+def case_servo_motion_tick():
+    from servo import ServoFS90, ServoMotion
+    servos = [ServoFS90(pin) for pin in ('A0', 'A1', 'A2', 'A3')]
+    motion = ServoMotion(*servos)
+
+    def tick():
+        if motion.done:
+            motion.move(180, 90, 45, 135, duration_ms=600000)
+        motion._tick(None)
+    return tick
+
+
+def case_ultrasonic_distance():
+    from ultrasonic import Ultrasonic
+    sim.devices.HCSR04('P12', 'P10', distance_cm=42)
+    u = Ultrasonic('P12', 'P10')
+    return u.distance_in_cm
+
+
+def case_ultrasonic_last_cm():
+    from ultrasonic import Ultrasonic
+    sim.devices.HCSR04('P12', 'P10', distance_cm=42)
+    u = Ultrasonic('P12', 'P10')
+    u.ping()
+    sim.board.advance(5000)
+    return u.last_cm
+
+
+def case_ultrasonic_mm():
+    from ultrasonic import Ultrasonic
+    sim.devices.HCSR04('P12', 'P10', distance_cm=42)
+    u = Ultrasonic('P12', 'P10')
+    u.set_range(500)
+    return u.distance_in_mm
+
+
+def case_ultrasonic_mm_compensated():
+    from thermo import Thermo
+    from ultrasonic import Ultrasonic
+    sim.devices.thermometer('A0', 24)
+    sim.devices.HCSR04('P12', 'P10', distance_cm=42)
+    u = Ultrasonic('P12', 'P10')
+    u.set_range(500)
+    u.set_thermometer(Thermo('A0'))
+    return u.distance_in_mm
+
+
+def case_ultrasonic_out_of_range():
+    from ultrasonic import Ultrasonic
+    sim.devices.HCSR04('P12', 'P10', distance_cm=80)
+    u = Ultrasonic('P12', 'P10')
+    u.set_range(500)
+    # Препятствие дальше диапазона: эхо длиннее ожидания, и измерения подряд
+    # не должны отсчитывать его хвост
+    readings = [u.range_us() for _ in range(8)]
+    if readings != [-1] * 8:
+        raise AssertionError('out of range readings: ' + repr(readings))
+    return u.range_us
+
+
+def case_ultrasonic_median():
+    import ultrasonic
+    u = ultrasonic.Ultrasonic('P12', 'P10')
+    u.set_filter(ultrasonic.MEDIAN, 5)
+    for pulse in (2448, 2507, -1, 4198, 2390, 2448):
+        u._add(pulse)
+
+    def read():
+        u._add(2420)
+        return u.filtered_us()
+    return read
+
+
+def case_sonar_ring_tick():
+    from ultrasonic import Ultrasonic, SonarRing
+    # gap_ms=0: каждый вызов запускает датчик, измеряется путь с ping()
+    ring = SonarRing(Ultrasonic('P12', 'P10'), Ultrasonic('P13', 'P11'), Ultrasonic('P9', 'P8'),
+                     gap_ms=0)
+    sensors = ring.sensors
+
+    def tick():
+        ring._tick(None)
+        sensors[ring._current]._state = 0  # эхо пришло
+    return tick
+
+
+def case_thermo_oversampled():
+    from thermo import Thermo
+    sim.devices.thermometer('A0', 21.3)
+    t = Thermo('A0')
+    t.set_oversampling(16)
+    return lambda: t.get_temps('c', 'f')
+
+
+def case_thermo_cached():
+    from thermo import Thermo
+    sim.devices.thermometer('A0', 21.3)
+    t = Thermo('A0')
+    t.set_cache(1000, background=False)
+    return t.get_temp
+
+
+def case_sampler_tick():
+    from sampler import ADCSampler
+    sim.devices.thermometer('A0', 21.3)
+    s = ADCSampler('A0', 'A1', 'A2', size=100)
+    return lambda: s._tick(None)
+
+
+def case_nec_decode():
+    from ir import NEC_ABC
+    from machine import Pin
+    irc = NEC_ABC(Pin('P3', Pin.IN), True, lambda cmd, addr, ext: None)
+    recorded = sim.devices.NECRemote.edges(0x6891, 0x0b)
+    times = irc._times
+
+    def decode():
+        for i in range(68):
+            times[i] = recorded[i]
+        irc.edge = 68
+        irc.decode(None)
+    return decode
+
+
+def case_note_freq():
+    from buzzer import note_freq
+    return lambda: note_freq('g#4')
+
+
+def case_isplit():
+    from buzzer import isplit
+    song = "t=100 8e2 4g2 4- 8g2 4e2 4- 8a2 8g2 8a2 8g2"
+    return lambda: list(isplit(song))
+
+
+def _midi_file():
+    def var_len(value):
+        out = [value & 0x7f]
+        value >>= 7
+        while value:
+            out.insert(0, (value & 0x7f) | 0x80)
+            value >>= 7
+        return bytes(out)
+
+    events = b'\x00\xff\x51\x03\x07\xa1\x20'  # темп 120 bpm
+    for pitch in (60, 62, 64, 65, 67, 69, 71, 72) * 4:
+        events += b'\x00\x90' + bytes((pitch, 100))
+        events += var_len(240) + b'\x90' + bytes((pitch, 0))
+    events += b'\x00\xff\x2f\x00'
+    data = b'MThd' + struct.pack('>ihhh', 6, 1, 2, 480)
+    data += b'MTrk' + struct.pack('>i', 4) + b'\x00\xff\x2f\x00'
+    data += b'MTrk' + struct.pack('>i', len(events)) + events
+    fd, path = tempfile.mkstemp(suffix='.mid')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    atexit.register(os.remove, path)
+    return path
+
+
+def case_midi_read_track():
+    from buzzer import MidiFile
+    midi = MidiFile(_midi_file())
+    return lambda: midi.read_track(1)
+
+
+CASES = [
+    ('pwm.PWM.duty', case_pwm_duty),
+    ('pwm.PWM.duty_u16', case_pwm_duty_u16),
+    ('pwm.PWM.duty_ticks', case_pwm_duty_ticks),
+    ('motors2wd.Motor.forward', case_motor_forward),
+    ('motors2wd.Motors2WD.left', case_motors2wd_left),
+    ('motors2wd.Motors2WD.left_registers', case_motors2wd_left_registers),
+    ('motors2wd.Motors2WD.reverse_motors', case_motors2wd_reverse),
+    ('motors2wd.Motors2WD.drive_tick', case_motors2wd_drive_tick),
+    ('motors2wd.SpeedControl.tick_2_wheels', case_speed_control_tick),
+    ('motors2wd.MotionQueue.tick', case_motion_queue_tick),
+    ('buzzer.BuzzerPlayer.tone_with_motors_and_led', case_full_robot_tone),
+    ('led.LEDBank.pattern', case_led_bank_pattern),
+    ('led.LEDBank.rotate', case_led_bank_rotate),
+    ('led.LEDpwm.brightness', case_ledpwm_brightness),
+    ('led.LEDMux.tick_12_leds', case_ledmux_tick),
+    ('servo.ServoFS90.set_angle', case_servo_set_angle),
+    ('servo.ServoMotion.tick_4_servos', case_servo_motion_tick),
+    ('ultrasonic.Ultrasonic.distance_in_cm', case_ultrasonic_distance),
+    ('ultrasonic.Ultrasonic.last_cm', case_ultrasonic_last_cm),
+    ('ultrasonic.Ultrasonic.distance_in_mm', case_ultrasonic_mm),
+    ('ultrasonic.Ultrasonic.distance_in_mm_compensated', case_ultrasonic_mm_compensated),
+    ('ultrasonic.Ultrasonic.range_us_out_of_range', case_ultrasonic_out_of_range),
+    ('ultrasonic.Ultrasonic.filtered_us_median5', case_ultrasonic_median),
+    ('ultrasonic.SonarRing.tick_3_sensors', case_sonar_ring_tick),
+    ('thermo.Thermo.get_temps_oversampled', case_thermo_oversampled),
+    ('thermo.Thermo.get_temp_cached', case_thermo_cached),
+    ('sampler.ADCSampler.tick_3_channels', case_sampler_tick),
+    ('ir.NEC_ABC.decode', case_nec_decode),
+    ('buzzer.note_freq', case_note_freq),
+    ('buzzer.isplit', case_isplit),
+    ('buzzer.MidiFile.read_track', case_midi_read_track),
+]
+
+# Пути, которые не должны выделять память вовсе, независимо от базы
+ALLOC_FREE = {
+    'motors2wd.Motors2WD.reverse_motors',
+}
+
+
+# --- измерения ---
+
+def _loop_ns(fn, number):
+    start = perf_counter_ns()
+    for _ in range(number):
+        fn()
+    return (perf_counter_ns() - start) / number
+
+
+def _number(fn):
+    # Число вызовов, при котором замер длится не меньше MIN_TIME_NS
+    number = 1
+    while _loop_ns(fn, number) * number < MIN_TIME_NS:
+        number *= 2
+    return number
+
+
+def _reference():
+    x = 0
+    for i in range(100):
+        x += i
+    return x
+
+
+def time_per_call(fn):
+    """
+    Время вызова fn в наносекундах и его отношение ко времени эталонного цикла.
+    Замеры fn и эталона чередуются, берётся медиана из REPEAT отношений,
+    поэтому результат мало зависит от скорости и загрузки машины.
+    """
+    number = _number(fn)
+    ref_number = _number(_reference)
+    times = []
+    ratios = []
+    for _ in range(REPEAT):
+        ref = _loop_ns(_reference, ref_number)
+        ns = _loop_ns(fn, number)
+        times.append(ns)
+        ratios.append(ns / ref)
+    times.sort()
+    ratios.sort()
+    return times[REPEAT // 2], ratios[REPEAT // 2]
+
+
+def alloc_per_call(fn):
+    """
+    Наименьший из REPEAT пиковых объёмов памяти в байтах, выделенной за один вызов fn.
+    """
+    fn()
+    gc.disable()
+    tracemalloc.start()
+    try:
+        best = None
+        for _ in range(REPEAT):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn()
+            used = tracemalloc.get_traced_memory()[1] - current
+            best = used if best is None else min(best, used)
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    return best
+
+
+def run(names=None):
+    import pwm
+    import ramp
+    results = {}
+    for name, setup in CASES:
+        if names and name not in names:
+            continue
+        # Каждый сценарий получает чистую плату и свободные таймеры. Драйверы
+        # импортируют pwm.timers при загрузке, поэтому реестр очищается на месте
+        pwm.timers.reset()
+        ramp._engine = None
+        sim.reset()
+        sim.board.record = False
+        fn = setup()
+        ns, score = time_per_call(fn)
+        results[name] = {
+            'ns_per_call': round(ns, 1),
+            'score': round(score, 3),
+            'alloc_bytes_per_call': alloc_per_call(fn),
+        }
+    return {'results': results}
+
+
+def compare(current, baseline, tolerance):
+    """
+    Возвращает список регрессий относительно базы.
+    """
+    regressions = []
+    for name in ALLOC_FREE:
+        result = current['results'].get(name)
+        if result is not None and result['alloc_bytes_per_call']:
+            regressions.append('{}: allocates {} bytes per call, must not allocate'.format(
+                name, result['alloc_bytes_per_call']))
+    for name, base in baseline['results'].items():
+        result = current['results'].get(name)
+        if result is None:
+            continue
+        if result['score'] > base['score'] * (1 + tolerance):
+            regressions.append('{}: {:.2f} > {:.2f} (slower by {:.0%})'.format(
+                name, result['score'], base['score'], result['score'] / base['score'] - 1))
+        if result['alloc_bytes_per_call'] > base['alloc_bytes_per_call']:
+            regressions.append('{}: allocates {} bytes per call, baseline {}'.format(
+                name, result['alloc_bytes_per_call'], base['alloc_bytes_per_call']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Driver hot path benchmarks')
+    parser.add_argument('names', nargs='*', help='run only these benchmarks')
+    parser.add_argument('-o', '--output', help='write JSON results to this file')
+    parser.add_argument('-b', '--baseline', default=BASELINE, help='baseline JSON file')
+    parser.add_argument('--save', action='store_true', help='store results as the new baseline')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.3,
+                        help='allowed relative slowdown, default 0.3')
+    args = parser.parse_args(argv)
+
+    current = run(args.names)
+    text = json.dumps(current, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.save:
+        if args.names and os.path.exists(args.baseline):
+            # Частичный прогон обновляет только свои записи базы
+            with open(args.baseline) as f:
+                saved = json.load(f)
+            saved['results'].update(current['results'])
+            text = json.dumps(saved, indent=2, sort_keys=True)
+        with open(args.baseline, 'w') as f:
+            f.write(text + '\n')
+        return 0
+    if not os.path.exists(args.baseline):
+        print('No baseline at ' + args.baseline + ', run with --save', file=sys.stderr)
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(current, baseline, args.tolerance)
+    for line in regressions:
+        print('REGRESSION ' + line, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -347,7 +347,8 @@ class BuzzerPlayer(object):
         :param duration: время звучания в милисекундах
         :param duty: влияет на громкость сигнала. 1-25 сигнал увеличивается, затем снова затухает до 26-50 и так далее
         """
-        self.buzzer_pin.frequency(int(hz))  # change frequency for change tone
+        if hz > 0:
+            self.buzzer_pin.frequency(int(hz))  # change frequency for change tone
         self.buzzer_pin.pulse_width_percent(duty)
         delay(duration)
         self.buzzer_pin.value(0)
@@ -1,5 +1,13 @@
-from pwm import PWM
+from array import array
+
+from pwm import PWM, timers
 from machine import Pin
+from ramp import engine, cancel
+
+try:
+    import stm
+except ImportError:
+    stm = None
 
 
 class LED(Pin):
@@ -57,13 +65,308 @@ class LED(Pin):
             self.value(1)
 
 
+class LEDBank:
+    """
+    Ряд светодиодов на пинах одного GPIO-порта.
+    Бит i маски соответствует i-му пину из списка; все светодиоды ряда
+    переключаются одной записью в регистр BSRR порта, без чтения и записи ODR,
+    поэтому прерывания, меняющие другие пины порта, не теряют своих изменений.
+    """
+    __slots__ = ['pins', '_n', '_all', '_lo', '_hi', '_bsrr', '_state']
+
+    def __init__(self, *pids: str):
+        if not 0 < len(pids) <= 16:
+            raise ValueError('LEDBank needs from 1 to 16 pins')
+        self.pins = [Pin(pid, Pin.OUT) for pid in pids]
+        gpio = self.pins[0].gpio()
+        for pid, p in zip(pids, self.pins):
+            if p.gpio() != gpio:
+                raise ValueError(pid + ' Pin is on another GPIO port, all LEDs of a bank must share one port')
+        self._n = len(pids)
+        # Таблицы перевода маски светодиодов в маску пинов порта: младший и старший байт
+        self._lo = self._table(0)
+        self._hi = self._table(8)
+        self._all = self._lo[0xff] | self._hi[0xff]
+        if stm is not None:
+            self._bsrr = gpio + stm.GPIO_BSRR
+        self._state = 0
+        self.pattern(0)
+
+    def _table(self, first: int):
+        table = array('H', [0] * 256)
+        for v in range(256):
+            m = 0
+            for b in range(8):
+                if v >> b & 1 and first + b < self._n:
+                    m |= 1 << self.pins[first + b].pin()
+            table[v] = m
+        return table
+
+    def _port_mask(self, mask: int) -> int:
+        return self._lo[mask & 0xff] | self._hi[(mask >> 8) & 0xff]
+
+    def _write_pins(self):
+        # Запасной путь без модуля stm: по вызову на светодиод
+        state = self._state
+        for i in range(self._n):
+            self.pins[i].value(state >> i & 1)
+
+    def _write_state(self):
+        # Состояние ряда пишется в BSRR без чтения ODR: остальные пины порта
+        # (например, направление моторов, которое меняют прерывания) не затрагиваются
+        on = self._port_mask(self._state)
+        off = self._all & ~on
+        if off >> 14:
+            # off << 16 не поместится в малое целое: две записи, каждая по-прежнему атомарна
+            stm.mem16[self._bsrr + 2] = off
+            stm.mem16[self._bsrr] = on
+        else:
+            stm.mem32[self._bsrr] = on | off << 16
+
+    def set(self, mask: int) -> None:
+        """
+        Включает светодиоды, отмеченные единицами в mask.
+        """
+        self._state |= mask
+        if stm is None:
+            self._write_pins()
+        else:
+            stm.mem16[self._bsrr] = self._port_mask(mask)
+
+    def clear(self, mask: int) -> None:
+        """
+        Выключает светодиоды, отмеченные единицами в mask.
+        """
+        self._state &= ~mask
+        if stm is None:
+            self._write_pins()
+        else:
+            stm.mem16[self._bsrr + 2] = self._port_mask(mask)
+
+    def toggle(self, mask=0xffff) -> None:
+        """
+        Переключает светодиоды, отмеченные единицами в mask, по умолчанию все.
+        """
+        self._state ^= mask
+        if stm is None:
+            self._write_pins()
+        else:
+            self._write_state()
+
+    def pattern(self, mask: int) -> None:
+        """
+        Зажигает ровно те светодиоды, что отмечены единицами в mask, остальные гасит.
+        """
+        self._state = mask
+        if stm is None:
+            self._write_pins()
+        else:
+            self._write_state()
+
+    def rotate(self, step=1) -> None:
+        """
+        Сдвигает текущий рисунок по кругу на step позиций, удобно для бегущих огней.
+        """
+        n = self._n
+        step %= n
+        state = self._state & ((1 << n) - 1)
+        self.pattern(((state << step) | (state >> (n - step))) & ((1 << n) - 1))
+
+    def value(self) -> int:
+        """
+        Возвращает маску включённых светодиодов.
+        """
+        return self._state & ((1 << self._n) - 1)
+
+    def __len__(self):
+        return self._n
+
+
+class LEDMux:
+    """
+    Программный ШИМ и мигание для светодиодов LED на любых пинах.
+    Все светодиоды обслуживаются одним прерыванием таймера по таблице
+    фиксированного размера; пин переключается только при смене уровня.
+    """
+    __slots__ = ['freq', '_timer', '_leds', '_period', '_on', '_phase', '_left', '_level']
+
+    def __init__(self, size=16, timer=8, freq=1000):
+        """
+        :param size: сколько светодиодов можно обслуживать одновременно
+        :param timer: номер аппаратного таймера для прерывания
+        :param freq: частота прерывания в герцах, шаг расписания 1/freq секунды
+        """
+        self.freq = freq
+        self._leds = [None] * size
+        self._period = array('i', [1] * size)  # период в шагах
+        self._on = array('i', [0] * size)  # сколько шагов периода светодиод горит
+        self._phase = array('i', [0] * size)  # текущий шаг периода
+        self._left = array('i', [0] * size)  # шагов до конца разового импульса, 0 - бесконечно
+        self._level = bytearray(size)
+        self._timer = timer
+        timers.periodic(timer, freq, self._tick)
+
+    def _ticks(self, ms: int) -> int:
+        ticks = ms * self.freq // 1000
+        return ticks if ticks > 0 else 1
+
+    def _start(self, led: LED, period: int, on: int, left: int) -> None:
+        leds = self._leds
+        slot = -1
+        for i in range(len(leds)):
+            if leds[i] is led:
+                slot = i
+                break
+            if slot < 0 and leds[i] is None:
+                slot = i
+        if slot < 0:
+            raise RuntimeError('No free LEDMux slots, increase LEDMux size')
+        leds[slot] = None  # пока слот заполняется, прерывание его пропускает
+        self._period[slot] = period
+        self._on[slot] = on
+        self._phase[slot] = 0
+        self._left[slot] = left
+        level = 1 if on > 0 else 0
+        self._level[slot] = level
+        led.value(level)
+        leds[slot] = led
+
+    def blink(self, led: LED, period_ms: int, on_ms=None) -> None:
+        """
+        Мигает светодиодом с периодом period_ms.
+        on_ms: сколько миллисекунд периода светодиод горит, по умолчанию половину
+        """
+        period = self._ticks(period_ms)
+        on = period // 2 if on_ms is None else self._ticks(on_ms)
+        self._start(led, period, on, 0)
+
+    def dim(self, led: LED, percent: int, period_ms=10) -> None:
+        """
+        Задаёт яркость светодиода программным ШИМ.
+        percent: от 0 до 100
+        period_ms: период ШИМ; при freq=1000 и 10 мс яркость меняется шагами по 10%
+        """
+        if percent < 0:
+            percent = 0
+        elif percent > 100:
+            percent = 100
+        period = self._ticks(period_ms)
+        self._start(led, period, period * percent // 100, 0)
+
+    def pulse(self, led: LED, ms: int) -> None:
+        """
+        Зажигает светодиод на ms миллисекунд, затем гасит и освобождает слот.
+        """
+        ticks = self._ticks(ms)
+        self._start(led, ticks + 1, ticks, ticks)
+
+    def release(self, led: LED) -> None:
+        """
+        Убирает светодиод из расписания и выключает его.
+        """
+        leds = self._leds
+        for i in range(len(leds)):
+            if leds[i] is led:
+                leds[i] = None
+                led.value(0)
+
+    def deinit(self) -> None:
+        """
+        Выключает все светодиоды расписания и освобождает таймер.
+        """
+        timers.stop_periodic(self._timer)
+        for led in self._leds:
+            if led is not None:
+                self.release(led)
+
+    def _tick(self, t):
+        leds = self._leds
+        for i in range(len(leds)):
+            led = leds[i]
+            if led is None:
+                continue
+            phase = self._phase[i] + 1
+            if phase >= self._period[i]:
+                phase = 0
+            self._phase[i] = phase
+            level = 1 if phase < self._on[i] else 0
+            left = self._left[i]
+            if left:
+                left -= 1
+                self._left[i] = left
+                if not left:
+                    leds[i] = None
+                    level = 0
+            if level != self._level[i]:
+                self._level[i] = level
+                led.value(level)
+
+
+_gamma_tables = {}
+
+
+def gamma_table(gamma=2.2):
+    """
+    Возвращает таблицу гамма-коррекции: 256 уровней воспринимаемой яркости
+    в скважность 0-65535. Таблица для каждого значения gamma строится один раз.
+    """
+    table = _gamma_tables.get(gamma)
+    if table is None:
+        table = array('H', [int((i / 255) ** gamma * 0xffff + 0.5) for i in range(256)])
+        _gamma_tables[gamma] = table
+    return table
+
+
+class _Fader:
+    """
+    Посредник для движка рамп: рампа идёт по воспринимаемой яркости,
+    а каждый её шаг превращается в тики одной выборкой из таблицы.
+    """
+    __slots__ = ['led']
+
+    def __init__(self, led):
+        self.led = led
+
+    def get_u16(self) -> int:
+        return self.led._level << 8
+
+    def duty_u16(self, value: int) -> None:
+        led = self.led
+        led._level = value >> 8
+        led.duty_ticks(led._ticks_table[value >> 8])
+
+
 class LEDpwm(PWM):
+    """
+    Светодиод с регулировкой яркости и гамма-коррекцией
+    """
     _brightness = 0
 
-    def __init__(self, p: str):
+    def __init__(self, p: str, gamma=2.2, table=None):
+        """
+        :param gamma: показатель гамма-кривой для типа светодиода
+        :param table: своя таблица из 256 значений скважности 0-65535 вместо гамма-кривой
+        """
         super().__init__(p, freq=1250, width=255)
+        self._gamma = table if table is not None else gamma_table(gamma)
+        self._level = 0
+        self._fader = _Fader(self)
+        self._build_ticks()
+
+    def _build_ticks(self):
+        # Перевод таблицы яркости в тики таймера под текущий период
+        period = self._period
+        self._ticks_table = array('I', [v * period // 0xffff for v in self._gamma])
+
+    def _rescale(self, freq: int) -> None:
+        super()._rescale(freq)
+        self._build_ticks()
 
-    def brightness(self, val=None) -> int:
+    def brightness(self, val=None, ramp_ms=0) -> int:
+        """
+        Задаёт или возвращает яркость светодиода от 0 до 100 с учётом гамма-коррекции.
+        ramp_ms: если задано, яркость меняется плавно за указанное время, не блокируя программу
+        """
         if val is not None:
             if val < 0:
                 val = 0
@@ -71,11 +374,11 @@ class LEDpwm(PWM):
                 val = 100
         else:
             return self._brightness
-        if val == 0:
-            self.p.low()
-            self.duty(0)
-            self._brightness = 0
-
-        if val is not None and val > 0:
-            self.duty(val)
-            self._brightness = val
+        self._brightness = val
+        level = int(val * 255) // 100
+        if ramp_ms:
+            engine().start(self._fader, level << 8 | level, ramp_ms)
+            return
+        cancel(self._fader)
+        self._level = level
+        self.duty_ticks(self._ticks_table[level])
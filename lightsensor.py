@@ -1,9 +1,11 @@
 from pyb import ADC
 from machine import Pin
 
+from sampler import SampledADC
+
 # Work In Progress
 
-class LightSensor(ADC):
+class LightSensor(SampledADC, ADC):
     R_DIVIDER = 10.0 # constant resistor  value
     LDR_10LUX = 14.0 #  LDR  resistance   at    10    lux
     LDR_GAMMA = 0.6 # gamma  slope(log10)K
@@ -6,95 +6,532 @@ P5 - E1 - работа мотора 1 - 1 работает, 0 не работа
 P6 - E2 - работа мотора 1 - 1 работает, 0 не работает
 P7 - H2 - направление вращения мотора 2 - 1 по часовой, 0 против часовой
 
+Энкодеры колёс подключаются к любым свободным пинам, см. Encoder и SpeedControl.
 """
-from pwm import PWM
+from array import array
+
+from pwm import PWM, PWMGroup, timers
 from machine import Pin
+from ramp import engine, cancel
+
+
+class Encoder(object):
+    """
+    Счётчик импульсов энкодера колеса.
+    Одноканальный энкодер считает только обороты, квадратурный (pin_b задан)
+    учитывает и направление: при вращении назад счёт уменьшается.
+    Импульсы считаются в прерывании пина без выделения памяти.
+    """
+    __slots__ = ['cpr', '_a', '_b', '_count']
+
+    def __init__(self, pin_a, pin_b=None, cpr=20):
+        """
+        :param pin_a: канал A, считаются его передние фронты
+        :param pin_b: канал B квадратурного энкодера или None
+        :param cpr: число импульсов канала A на оборот колеса
+        """
+        self.cpr = cpr
+        self._count = array('i', [0])
+        self._a = Pin(pin_a, Pin.IN, Pin.PULL_UP)
+        self._b = Pin(pin_b, Pin.IN, Pin.PULL_UP) if pin_b is not None else None
+        self._a.irq(handler=self._edge, trigger=Pin.IRQ_RISING)
+
+    def _edge(self, pin):
+        b = self._b
+        if b is None or not b.value():
+            self._count[0] += 1
+        else:
+            self._count[0] -= 1
+
+    def count(self) -> int:
+        """
+        Возвращает число импульсов с момента создания или reset()
+        """
+        return self._count[0]
+
+    def reset(self) -> None:
+        """
+        Обнуляет счётчик
+        """
+        self._count[0] = 0
+
+    def deinit(self) -> None:
+        """
+        Отключает прерывание
+        """
+        self._a.irq(handler=None)
 
 
 class Motor(object):
     """
     Класс работы с мотором
     """
-    __slots__ = ['_hpin', '_epin', '_direction', '_power', '_mode']
+    __slots__ = ['_hpin', '_epin', '_direction', '_power', '_mode', 'encoder']
 
-    def __init__(self, h_pin, e_pin, mode=1):
+    def __init__(self, h_pin, e_pin, mode=1, encoder=None):
+        """
+        :param encoder: Encoder колеса, нужен для SpeedControl
+        """
         self._hpin = Pin(h_pin, Pin.OUT)
         self._epin = PWM(e_pin)
         self._mode = mode
+        self.encoder = encoder
+
+    def reverse(self):
+        """
+        Меняет местами направления 'вперёд' и 'назад'.
+        Новое направление применяется при следующей команде движения,
+        ШИМ и таймер не трогаются.
+        """
+        self._mode ^= 1
 
     def stop(self):
         """
         Останавливает мотор
         """
+        cancel(self._epin)
         self._epin.value(0)
 
-    def forward(self, power=100):
+    def _run(self, power, ramp_ms):
+        if ramp_ms:
+            engine().start(self._epin, int(power * 0xffff) // 100, ramp_ms)
+        else:
+            cancel(self._epin)
+            self._epin.duty(power)
+
+    def forward(self, power=100, ramp_ms=0):
         """
         Движение мотора 'вперёд'
+        ramp_ms - плавный разгон до power за указанное время, не блокируя программу
         """
         self._hpin.value(self._mode)
-        self._epin.duty(power)
+        self._run(power, ramp_ms)
 
-    def backward(self, power=100):
+    def backward(self, power=100, ramp_ms=0):
         """
         Движение мотора 'назад'
+        ramp_ms - плавный разгон до power за указанное время, не блокируя программу
         """
         self._hpin.value(int(self._mode + 1) % 2)
-        self._epin.duty(power)
+        self._run(power, ramp_ms)
 
 
 class Motors2WD(object):
     """
     Класс для двухколёсной системы моторов.
     """
-    __slots__ = ['M1', 'M2', 'reversed']
+    __slots__ = ['M1', 'M2', 'reversed', 'accel', '_group', '_drive_timer', '_drive_freq',
+                 '_driving', '_ticking', '_speed', '_target', '_step']
 
-    def __init__(self):
+    def __init__(self, accel=200, drive_timer=10, drive_freq=50):
+        """
+        :param accel: предельное ускорение колёс для drive, в процентах мощности в секунду
+        :param drive_timer: номер таймера для плавного разгона в drive, занимается при первом вызове drive
+        :param drive_freq: частота шагов разгона в герцах
+        """
         self.reversed = False
         self.M1 = Motor('P4', "P5", mode=int(not self.reversed))
         self.M2 = Motor('P7', 'P6', mode=int(self.reversed))
+        # P5 и P6 висят на таймере 3, поэтому скорости колёс меняются в одном периоде ШИМ
+        self._group = PWMGroup(self.M1._epin, self.M2._epin)
+        self.accel = accel
+        self._drive_timer = drive_timer
+        self._drive_freq = drive_freq
+        self._driving = False
+        self._ticking = False  # задача разгона запускается при первом вызове drive
+        self._speed = array('i', [0, 0])  # текущие скорости M1 и M2 со знаком, -65535..65535
+        self._target = array('i', [0, 0])  # скорости, к которым идёт разгон
+        self._step = 0  # изменение скорости за шаг разгона
+
+    def drive(self, v, omega=0):
+        """
+        Движение с линейной скоростью v и скоростью поворота omega.
+        Колёса разгоняются и тормозят с ускорением не больше accel, смена
+        направления проходит через остановку; программа при этом не блокируется.
+        v - скорость вперёд от -100 до 100, отрицательная - назад
+        omega - поворот от -100 до 100, положительный - налево
+        """
+        right = v + omega  # M1 - правое колесо
+        left = v - omega  # M2 - левое колесо
+        top = max(abs(right), abs(left))
+        if top > 100:
+            # Сохраняем отношение скоростей колёс, то есть радиус дуги
+            right = right * 100 / top
+            left = left * 100 / top
+        # accel можно менять между вызовами, поэтому шаг считается каждый раз
+        self._step = max(1, self.accel * 0xffff // (100 * self._drive_freq))
+        self._target[0] = int(right * 0xffff) // 100
+        self._target[1] = int(left * 0xffff) // 100
+        if self._driving:
+            return
+        self._cancel_ramps()
+        for i, m in enumerate((self.M1, self.M2)):
+            speed = m._epin.get_u16()
+            self._speed[i] = speed if m._hpin.value() == m._mode else -speed
+        if not self._ticking:
+            self._ticking = True
+            timers.periodic(self._drive_timer, self._drive_freq, self._drive_tick)
+        self._driving = True
+
+    def _drive_tick(self, t):
+        if not self._driving:
+            return
+        speed = self._speed
+        target = self._target
+        if speed[0] == target[0] and speed[1] == target[1]:
+            return  # скорости уже достигнуты и записаны
+        step = self._step
+        for i in range(2):
+            cur = speed[i]
+            tgt = target[i]
+            if cur < tgt:
+                cur = cur + step if tgt - cur > step else tgt
+            elif cur > tgt:
+                cur = cur - step if cur - tgt > step else tgt
+            speed[i] = cur
+        m1 = self.M1
+        m2 = self.M2
+        m1._hpin.value(m1._mode if speed[0] >= 0 else 1 - m1._mode)
+        m2._hpin.value(m2._mode if speed[1] >= 0 else 1 - m2._mode)
+        self._group.duty_u16(abs(speed[0]), abs(speed[1]))
+
+    def _cancel_ramps(self):
+        # Иначе рампа Motor.forward(..., ramp_ms) продолжит менять скважность после команды
+        cancel(self.M1._epin)
+        cancel(self.M2._epin)
+
+    def _drive(self, forward1, forward2, power):
+        self._driving = False
+        self._cancel_ramps()
+        m1 = self.M1
+        m2 = self.M2
+        m1._hpin.value(m1._mode if forward1 else 1 - m1._mode)
+        m2._hpin.value(m2._mode if forward2 else 1 - m2._mode)
+        self._group.duty(power, power)
 
     def forward(self, power=100):
         """
         Движение вперёд
         power - определяет влияния, по умолчанию 100%
         """
-        self.M1.forward(power)
-        self.M2.forward(power)
+        self._drive(True, True, power)
 
     def backward(self, power=100):
         """
         Движение назад
         power - определяет влияния, по умолчанию 100%
         """
-        self.M1.backward(power)
-        self.M2.backward(power)
+        self._drive(False, False, power)
 
     def stop(self):
         """
         Остановка платформы
         """
-        self.M1.stop()
-        self.M2.stop()
+        self._driving = False
+        self._cancel_ramps()
+        self._group.duty(0, 0)
 
     def reverse_motors(self):
         """
-        Меняет направление вращения моторов.
+        Меняет направление вращения моторов без создания новых объектов.
+        Новое направление применяется при следующей команде движения.
         """
         self.reversed = not self.reversed
-        self.M1 = Motor('P4', "P5", mode=int(not self.reversed))
-        self.M2 = Motor('P7', 'P6', mode=int(self.reversed))
+        self.M1.reverse()
+        self.M2.reverse()
+        if self._driving:
+            # Скорости drive отсчитываются от направления 'вперёд': колёса крутятся
+            # как прежде, а знак меняется, иначе следующий шаг разгона сразу
+            # переключил бы мост на полной скорости
+            speed = self._speed
+            speed[0] = -speed[0]
+            speed[1] = -speed[1]
 
     def left(self, power=100):
         """
         Поворот налево
         """
-        self.M1.forward(power)
-        self.M2.backward(power)
+        self._drive(True, False, power)
 
     def right(self, power=100):
         """
         Поворот направо
         """
-        self.M1.backward(power)
-        self.M2.forward(power)
+        self._drive(False, True, power)
+
+
+class SpeedControl(object):
+    """
+    Поддержание заданных оборотов колёс с помощью энкодеров.
+    ПИД-регулятор работает в прерывании аппаратного таймера и сам меняет
+    скважность ШИМ моторов, поэтому скорость не падает вместе с батареей.
+    Шаг регулятора использует только целые числа и не выделяет память,
+    так что частоту можно поднимать до 500 Гц.
+    """
+    __slots__ = ['freq', 'rpm', '_motors', '_timer', '_target', '_last', '_window', '_slot',
+                 '_sum', '_integral', '_error', '_duty', '_kp', '_ki', '_kd', '_scale', '_limit']
+
+    def __init__(self, *motors: Motor, timer=11, freq=200, kp=100, ki=600, kd=0, window_ms=100):
+        """
+        :param motors: моторы с подключёнными энкодерами
+        :param timer: номер аппаратного таймера для прерывания
+        :param freq: частота шагов регулятора в герцах
+        :param kp: пропорциональный коэффициент, единиц скважности 0-65535 на об/мин ошибки
+        :param ki: интегральный коэффициент, единиц скважности на об/мин ошибки за секунду
+        :param kd: дифференциальный коэффициент, единиц скважности на об/мин изменения ошибки за шаг
+        :param window_ms: окно усреднения измеренной скорости
+        """
+        for m in motors:
+            if m.encoder is None:
+                raise ValueError('Motor has no encoder')
+        n = len(motors)
+        self.freq = freq
+        self._motors = motors
+        self._kp = kp
+        self._ki = ki
+        self._kd = kd
+        size = max(1, window_ms * freq // 1000)
+        # Импульсы за окно переводятся в об/мин умножением на _scale // cpr
+        self._scale = 60 * freq // size
+        self._window = [array('i', [0] * size) for _ in range(n)]  # импульсы за каждый шаг окна
+        self._slot = 0
+        self._sum = array('i', [0] * n)  # импульсы за всё окно
+        self._last = array('i', [m.encoder.count() for m in motors])
+        self._target = array('i', [0] * n)  # заданные обороты, об/мин
+        self.rpm = array('i', [0] * n)  # измеренные обороты, об/мин
+        self._integral = array('i', [0] * n)
+        self._error = array('i', [0] * n)
+        self._duty = array('i', [0] * n)
+        # Интеграл ограничен так, чтобы его вклад не выходил за полную скважность
+        self._limit = 0xffff * freq // ki if ki else 0
+        self._timer = timer
+        timers.periodic(timer, freq, self._tick)
+
+    def set_rpm(self, *rpms) -> None:
+        """
+        Задаёт обороты колёс в том же порядке, что и моторы.
+        Отрицательные обороты - вращение назад, 0 - остановка.
+        """
+        motors = self._motors
+        for i in range(len(motors)):
+            m = motors[i]
+            rpm = int(rpms[i])
+            if (rpm < 0) != (self._target[i] < 0) or not rpm:
+                self._integral[i] = 0
+            cancel(m._epin)
+            m._hpin.value(m._mode if rpm >= 0 else 1 - m._mode)
+            self._target[i] = rpm
+
+    def stop(self) -> None:
+        """
+        Останавливает все колёса
+        """
+        for i in range(len(self._motors)):
+            self._target[i] = 0
+            self._integral[i] = 0
+
+    def deinit(self) -> None:
+        """
+        Останавливает регулятор и моторы, освобождает таймер
+        """
+        timers.stop_periodic(self._timer)
+        for m in self._motors:
+            m.stop()
+
+    def _tick(self, t):
+        motors = self._motors
+        slot = self._slot
+        for i in range(len(motors)):
+            m = motors[i]
+            enc = m.encoder
+            count = enc._count[0]
+            delta = count - self._last[i]
+            self._last[i] = count
+            if delta < 0:
+                delta = -delta
+            window = self._window[i]
+            total = self._sum[i] + delta - window[slot]
+            window[slot] = delta
+            self._sum[i] = total
+            rpm = total * self._scale // enc.cpr
+            target = self._target[i]
+            if target < 0:
+                target = -target
+                self.rpm[i] = -rpm
+            else:
+                self.rpm[i] = rpm
+            if not target:
+                self._error[i] = 0
+                if self._duty[i]:
+                    self._duty[i] = 0
+                    m._epin.duty_u16(0)
+                continue
+            error = target - rpm
+            integral = self._integral[i] + error
+            limit = self._limit
+            if integral > limit:
+                integral = limit
+            elif integral < -limit:
+                integral = -limit
+            self._integral[i] = integral
+            duty = (self._kp * error + self._ki * integral // self.freq
+                    + self._kd * (error - self._error[i]))
+            self._error[i] = error
+            if duty < 0:
+                duty = 0
+            elif duty > 0xffff:
+                duty = 0xffff
+            self._duty[i] = duty
+            m._epin.duty_u16(duty)
+        slot += 1
+        self._slot = 0 if slot == len(self._window[0]) else slot
+
+
+class MotionQueue(object):
+    """
+    Очередь команд движения для Motors2WD: "вперёд 1.2 с, налево 0.4 с, стоп".
+    Команды переключаются в прерывании таймера, поэтому основной цикл может
+    в это время опрашивать датчики. Когда очередь заканчивается, платформа
+    останавливается. Команда длится заданное время или, если у моторов есть
+    энкодеры, до прохождения заданного расстояния.
+    """
+    __slots__ = ['robot', 'freq', 'wheel_mm', '_timer', '_dirs', '_power', '_amount', '_by_distance',
+                 '_head', '_tail', '_left', '_distance', '_base', '_active']
+
+    def __init__(self, robot: Motors2WD, size=16, timer=12, freq=100, wheel_mm=204):
+        """
+        :param robot: платформа Motors2WD
+        :param size: сколько команд может ждать в очереди
+        :param timer: номер аппаратного таймера для прерывания
+        :param freq: частота проверок в герцах, определяет точность длительности команд
+        :param wheel_mm: длина окружности колеса в мм для команд с расстоянием
+        """
+        self.robot = robot
+        self.freq = freq
+        self.wheel_mm = wheel_mm
+        size += 1  # одна ячейка кольцевого буфера всегда пустая
+        self._dirs = bytearray(size)  # бит 0 - M1 вперёд, бит 1 - M2 вперёд
+        self._power = bytearray(size)  # мощность в процентах, 0 - стоять
+        self._amount = array('i', [0] * size)  # длительность в шагах или расстояние в импульсах энкодера
+        self._by_distance = bytearray(size)
+        # Команды добавляет только основная программа (_tail), а забирает только прерывание (_head)
+        self._head = 0
+        self._tail = 0
+        self._left = 0  # сколько осталось шагов или импульсов текущей команды
+        self._distance = False
+        self._base = array('i', [0, 0])  # показания энкодеров в начале команды
+        self._active = False
+        self._timer = timer
+        timers.periodic(timer, freq, self._tick)
+
+    def _add(self, dirs, power, ms, mm):
+        if mm:
+            m1 = self.robot.M1
+            m2 = self.robot.M2
+            if m1.encoder is None or m2.encoder is None:
+                raise ValueError('Distance commands need encoders on both motors')
+            amount = max(1, mm * m1.encoder.cpr // self.wheel_mm)
+        else:
+            amount = max(1, ms * self.freq // 1000)
+        tail = self._tail
+        nxt = tail + 1
+        if nxt == len(self._dirs):
+            nxt = 0
+        if nxt == self._head:
+            raise RuntimeError('Motion queue is full, increase MotionQueue size')
+        self._dirs[tail] = dirs
+        self._power[tail] = max(0, min(100, int(power)))
+        self._amount[tail] = amount
+        self._by_distance[tail] = 1 if mm else 0
+        self._tail = nxt
+
+    def forward(self, power=100, ms=0, mm=0) -> None:
+        """
+        Добавляет движение вперёд на ms миллисекунд или на mm миллиметров
+        """
+        self._add(3, power, ms, mm)
+
+    def backward(self, power=100, ms=0, mm=0) -> None:
+        """
+        Добавляет движение назад на ms миллисекунд или на mm миллиметров
+        """
+        self._add(0, power, ms, mm)
+
+    def left(self, power=100, ms=0, mm=0) -> None:
+        """
+        Добавляет поворот налево, mm - путь каждого колеса
+        """
+        self._add(1, power, ms, mm)
+
+    def right(self, power=100, ms=0, mm=0) -> None:
+        """
+        Добавляет поворот направо, mm - путь каждого колеса
+        """
+        self._add(2, power, ms, mm)
+
+    def pause(self, ms) -> None:
+        """
+        Добавляет остановку на ms миллисекунд
+        """
+        self._add(3, 0, ms, 0)
+
+    def emergency_stop(self) -> None:
+        """
+        Сразу останавливает платформу и очищает очередь
+        """
+        self._head = self._tail
+        self._left = 0
+        self._active = False
+        self.robot.stop()
+
+    def busy(self) -> bool:
+        """
+        Возвращает True, пока выполняется команда или очередь не пуста
+        """
+        return self._active or self._head != self._tail
+
+    def __len__(self):
+        n = self._tail - self._head
+        return n if n >= 0 else n + len(self._dirs)
+
+    def deinit(self) -> None:
+        """
+        Останавливает платформу и освобождает таймер
+        """
+        timers.stop_periodic(self._timer)
+        self.emergency_stop()
+
+    def _tick(self, t):
+        robot = self.robot
+        left = self._left
+        if left > 0:
+            if self._distance:
+                a = robot.M1.encoder._count[0] - self._base[0]
+                b = robot.M2.encoder._count[0] - self._base[1]
+                if a < 0:
+                    a = -a
+                if b < 0:
+                    b = -b
+                left = self._left if (a + b) >> 1 < left else 0
+            else:
+                left -= 1
+                self._left = left
+            if left > 0:
+                return
+        head = self._head
+        if head == self._tail:
+            if self._active:
+                self._active = False
+                self._left = 0
+                robot.stop()
+            return
+        dirs = self._dirs[head]
+        self._distance = self._by_distance[head] == 1
+        if self._distance:
+            self._base[0] = robot.M1.encoder._count[0]
+            self._base[1] = robot.M2.encoder._count[0]
+        self._left = self._amount[head]
+        self._active = True
+        robot._drive(dirs & 1, dirs & 2, self._power[head])
+        head += 1
+        self._head = 0 if head == len(self._dirs) else head
@@ -1,17 +1,161 @@
 from pyb import Timer
 from machine import Pin
 
+try:
+    import stm
+except ImportError:
+    stm = None
+
 __author__ = "Nikolay Putko"
 __copyright__ = "Nikolay Putko, 2022 onwards."
 __license__ = "MIT https://opensource.org/licenses/MIT (as used by MicroPython)."
-__version__ = "1.1.3"
+__version__ = "1.9.0"
+
+
+class TimerRegistry:
+    """
+    Общий для всей платы реестр аппаратных таймеров и каналов ШИМ.
+    Выдаёт уже созданные объекты Timer вместо повторной инициализации,
+    сообщает о конфликтах каналов и частот и считает занятые каналы каждого таймера.
+    """
+    __slots__ = ['_timers', '_channels', '_tasks', 'inits']
+
+    def __init__(self):
+        self._timers = {}  # номер таймера -> [Timer, частота, число занятых каналов]
+        self._channels = {}  # (номер таймера, номер канала) -> объект PWM
+        self._tasks = {}  # номер таймера -> Timer, отданный под прерывание
+        self.inits = 0  # сколько раз таймеры инициализировались
+
+    def claim(self, tid: int, ch: int, pwm, freq: int, strict=False):
+        """
+        Занимает канал ch таймера tid для объекта pwm.
+        Возвращает пару (Timer, фактическая частота таймера).
+        Если таймер уже работает на другой частоте для других пинов, пин получает
+        её же с предупреждением, а при strict=True (пину нужна точная частота,
+        например сервоприводу) бросается ValueError.
+        """
+        pin = pwm.pin
+        if tid in self._tasks:
+            raise ValueError(pin + ' Pin needs timer ' + str(tid) + ', which is used for interrupts')
+        owner = self._channels.get((tid, ch))
+        if owner is not None and owner.pin != pin:
+            raise ValueError(pin + ' Pin conflicts with ' + owner.pin +
+                             ': both use channel ' + str(ch) + ' of timer ' + str(tid))
+        entry = self._timers.get(tid)
+        if entry is None:
+            entry = [Timer(tid, freq=freq), freq, 0]
+            self._timers[tid] = entry
+            self.inits += 1
+        elif entry[1] != freq:
+            if entry[2] == 1 and owner is not None:
+                # Таймер принадлежит только этому пину - его можно перенастроить
+                entry[0].init(freq=freq)
+                entry[1] = freq
+                self.inits += 1
+            elif strict:
+                raise ValueError(pin + ' Pin needs ' + str(freq) + ' Hz, but timer ' + str(tid) +
+                                 ' already runs at ' + str(entry[1]) + ' Hz for another pin')
+            else:
+                print('\033[31mWarning: Таймер ' + str(tid) + ' уже работает на частоте ' +
+                      str(entry[1]) + ' Hz, пин ' + pin + ' получит её же\033[0m')
+        if owner is None:
+            entry[2] += 1
+        self._channels[(tid, ch)] = pwm
+        return entry[0], entry[1]
+
+    def release(self, tid: int, ch: int, pwm) -> None:
+        """
+        Освобождает канал. Таймер отключается, когда занятых каналов не остаётся.
+        """
+        if self._channels.get((tid, ch)) is not pwm:
+            return
+        del self._channels[(tid, ch)]
+        entry = self._timers[tid]
+        entry[2] -= 1
+        if entry[2] == 0:
+            entry[0].deinit()
+            del self._timers[tid]
+
+    def retune(self, tid: int, freq: int) -> None:
+        """
+        Меняет частоту уже работающего таймера без его переинициализации:
+        пересчитываются только предделитель и период.
+        Скважности всех каналов таймера пересчитываются под новый период.
+        """
+        entry = self._timers[tid]
+        if entry[1] != freq:
+            entry[0].freq(freq)
+            entry[1] = freq
+            for key in self._channels:
+                if key[0] == tid:
+                    self._channels[key]._rescale(freq)
+
+    def periodic(self, tid: int, freq: int, callback):
+        """
+        Отдаёт таймер tid целиком под периодическое прерывание:
+        callback вызывается freq раз в секунду.
+        """
+        if tid in self._timers or tid in self._tasks:
+            raise ValueError('Timer ' + str(tid) + ' is already in use')
+        t = Timer(tid, freq=freq, callback=callback)
+        self._tasks[tid] = t
+        self.inits += 1
+        return t
+
+    def reserve(self, tid: int, freq: int):
+        """
+        Отдаёт таймер tid целиком без прерывания, например как источник
+        событий с частотой freq для ADC.read_timed.
+        Освобождается так же, через stop_periodic().
+        """
+        if tid in self._timers or tid in self._tasks:
+            raise ValueError('Timer ' + str(tid) + ' is already in use')
+        t = Timer(tid, freq=freq)
+        self._tasks[tid] = t
+        self.inits += 1
+        return t
+
+    def stop_periodic(self, tid: int) -> None:
+        """
+        Останавливает прерывание и освобождает таймер, занятый periodic() или reserve().
+        """
+        t = self._tasks.pop(tid, None)
+        if t is not None:
+            t.deinit()
+
+    def reset(self) -> None:
+        """
+        Отключает все таймеры реестра и забывает занятые каналы.
+        Объекты, уже получившие таймеры, после этого пересоздаются.
+        """
+        for entry in self._timers.values():
+            entry[0].deinit()
+        for t in self._tasks.values():
+            t.deinit()
+        self._timers.clear()
+        self._channels.clear()
+        self._tasks.clear()
+        self.inits = 0
+
+    def refcount(self, tid: int) -> int:
+        """
+        Возвращает число каналов, занятых на таймере tid.
+        """
+        entry = self._timers.get(tid)
+        return entry[2] if entry is not None else 0
+
+
+timers = TimerRegistry()
+
+_UDIS = 1 << 1  # бит UDIS регистра TIMx_CR1: запрет события обновления
 
 
 class PWM:
     """
     Класс для работы с ШИМ-пинами в IskraJS
     """
-    __slots__ = ['pin', 'freq', 'width', 'cnl', 't', 'p']
+    __slots__ = ['pin', 'freq', 'width', 'cnl', 't', 'p', '_period', '_shift', '_ticks']
+    exact_freq = False  # True - частота обязательна, конфликт на общем таймере даёт ValueError
     pin_dict = {'A0': (2, 1),
                 'A1': (2, 2),
                 'A2': (2, 3),
@@ -41,14 +185,85 @@ class PWM:
 
         if p not in self.pin_dict.keys():
             raise ValueError(p + ' Pin is not allowed for PWM on Iskra board')
+        tid, ch = self.pin_dict[p]
         self.p = Pin(p, Pin.OUT)
-        self.t = Timer(self.pin_dict[p][0], freq=freq)
-        self.cnl = self.t.channel(self.pin_dict[p][1], Timer.PWM, pin=self.p)
+        self.t, self.freq = timers.claim(tid, ch, self, freq, self.exact_freq)
+        self.cnl = self.t.channel(ch, Timer.PWM, pin=self.p)
+        self._cache_period()
+        self._ticks = width
         self.cnl.pulse_width(width)
 
-    def frequency(self, hz: int):
-        self.freq = hz
-        self = self.__init__(self.pin, self.freq, self.width)
+    def _cache_period(self) -> None:
+        # Период в тиках и сдвиг, при котором (0xffff >> shift) * period
+        # остаётся малым целым MicroPython (меньше 2 ** 30)
+        self._period = self.t.period() + 1
+        shift = 0
+        while (0xffff >> shift) * self._period >= 1 << 30:
+            shift += 1
+        self._shift = shift
+
+    def _rescale(self, freq: int) -> None:
+        # Вызывается реестром после смены частоты таймера
+        old = self._period
+        self.freq = freq
+        self._cache_period()
+        if self._ticks:
+            self.duty_ticks(self._ticks * self._period // old)
+
+    def deinit(self) -> None:
+        """
+        Отключает ШИМ на пине и освобождает канал таймера.
+        """
+        self.cnl.pulse_width(0)
+        tid, ch = self.pin_dict[self.pin]
+        timers.release(tid, ch, self)
+
+    def frequency(self, hz: int) -> None:
+        """
+        Меняет частоту ШИМ на лету, не пересоздавая пин, таймер и канал.
+        Скважность сохраняется.
+        Обратите внимание: частота меняется у всех каналов этого таймера.
+        hz: частота в герцах
+        """
+        if hz <= 0:
+            print('\033[31mWarning: Частота не может быть меньше 1 Hz\033[0m')
+            hz = 1
+        timers.retune(self.pin_dict[self.pin][0], hz)
+
+    def period_ticks(self) -> int:
+        """
+        Возвращает длительность периода ШИМ в тиках таймера.
+        """
+        return self._period
+
+    def duty_ticks(self, ticks: int) -> None:
+        """
+        Запускает импульсы в пин, длительность импульса задаётся в тиках таймера.
+        ticks: от 0 до period_ticks()
+        """
+        if ticks < 0:
+            ticks = 0
+        elif ticks > self._period:
+            ticks = self._period
+        self._ticks = ticks
+        self.cnl.pulse_width(ticks)
+
+    def duty_u16(self, value: int) -> None:
+        """
+        Запускает импульсы в пин, скважность задаётся целым числом.
+        value: от 0 (выключено) до 65535 (100%)
+        """
+        if value >= 0xffff:
+            self.duty_ticks(self._period)
+        else:
+            shift = self._shift
+            self.duty_ticks(((value >> shift) * self._period) >> (16 - shift))
+
+    def get_u16(self) -> int:
+        """
+        Возвращает текущую скважность в формате 0-65535.
+        """
+        return self._ticks * 0xffff // self._period
 
     def duty(self, percent: float) -> None:
         """
@@ -57,9 +272,9 @@ class PWM:
         """
         if percent < 0:
             percent = 0
-        if percent > 100:
+        elif percent > 100:
             percent = 100
-        self.cnl.pulse_width_percent(percent)
+        self.duty_ticks(int(percent * self._period) // 100)
 
     def value(self, percent: float) -> None:
         """
@@ -74,3 +289,125 @@ class PWM:
         percent: Процентное значение единичных импульсов
         """
         self.duty(percent)
+
+
+def _percent_ticks(percent: float, period: int) -> int:
+    # То же, что PWM.duty, но без вызовов: процент -> тики с ограничением 0-100%
+    if percent <= 0:
+        return 0
+    if percent >= 100:
+        return period
+    return int(percent * period) // 100
+
+
+def _u16_ticks(value: int, pwm: PWM) -> int:
+    # То же, что PWM.duty_u16: 0-65535 -> тики
+    if value <= 0:
+        return 0
+    if value >= 0xffff:
+        return pwm._period
+    shift = pwm._shift
+    return ((value >> shift) * pwm._period) >> (16 - shift)
+
+
+class PWMGroup:
+    """
+    Группа ШИМ-каналов одного таймера (не больше четырёх).
+    Новые скважности всех каналов применяются одновременно
+    на ближайшем событии обновления таймера.
+    Если доступен модуль stm, скважности пишутся прямо в регистры TIMx_CCRn.
+    """
+    __slots__ = ['pwms', '_cr1', '_ccr']
+
+    def __init__(self, *pwms: PWM):
+        if not 0 < len(pwms) <= 4:
+            raise ValueError('PWMGroup needs from 1 to 4 PWMs')
+        tid = PWM.pin_dict[pwms[0].pin][0]
+        for p in pwms:
+            if PWM.pin_dict[p.pin][0] != tid:
+                raise ValueError(p.pin + ' Pin is not on timer ' + str(tid) +
+                                 ', all PWMs of a group must share one timer')
+        self.pwms = pwms
+        if stm is not None:
+            base = getattr(stm, 'TIM' + str(tid))
+            self._cr1 = base + stm.TIM_CR1
+            # Адреса регистров сравнения TIMx_CCR1..4 идут подряд через 4 байта
+            self._ccr = tuple(base + stm.TIM_CCR1 + 4 * (PWM.pin_dict[p.pin][1] - 1) for p in pwms)
+        else:
+            self._cr1 = None
+            self._ccr = None
+
+    def duty(self, d1: float, d2: float = 0, d3: float = 0, d4: float = 0) -> None:
+        """
+        Задаёт скважности всех каналов группы одним вызовом.
+        d1..d4: процентные значения в том же порядке, что и каналы группы
+        """
+        pwms = self.pwms
+        n = len(pwms)
+        cr1 = self._cr1
+        if cr1 is None:
+            pwms[0].duty(d1)
+            if n > 1:
+                pwms[1].duty(d2)
+                if n > 2:
+                    pwms[2].duty(d3)
+                    if n > 3:
+                        pwms[3].duty(d4)
+            return
+        mem = stm.mem32
+        ccr = self._ccr
+        # Пока обновление запрещено, новые значения ждут в теневых регистрах
+        stm.mem16[cr1] |= _UDIS
+        p = pwms[0]
+        p._ticks = t = _percent_ticks(d1, p._period)
+        mem[ccr[0]] = t
+        if n > 1:
+            p = pwms[1]
+            p._ticks = t = _percent_ticks(d2, p._period)
+            mem[ccr[1]] = t
+            if n > 2:
+                p = pwms[2]
+                p._ticks = t = _percent_ticks(d3, p._period)
+                mem[ccr[2]] = t
+                if n > 3:
+                    p = pwms[3]
+                    p._ticks = t = _percent_ticks(d4, p._period)
+                    mem[ccr[3]] = t
+        stm.mem16[cr1] &= ~_UDIS
+
+    def duty_u16(self, v1: int, v2: int = 0, v3: int = 0, v4: int = 0) -> None:
+        """
+        Задаёт скважности всех каналов группы одним вызовом в формате 0-65535.
+        v1..v4: значения в том же порядке, что и каналы группы
+        """
+        pwms = self.pwms
+        n = len(pwms)
+        cr1 = self._cr1
+        if cr1 is None:
+            pwms[0].duty_u16(v1)
+            if n > 1:
+                pwms[1].duty_u16(v2)
+                if n > 2:
+                    pwms[2].duty_u16(v3)
+                    if n > 3:
+                        pwms[3].duty_u16(v4)
+            return
+        mem = stm.mem32
+        ccr = self._ccr
+        stm.mem16[cr1] |= _UDIS
+        p = pwms[0]
+        p._ticks = t = _u16_ticks(v1, p)
+        mem[ccr[0]] = t
+        if n > 1:
+            p = pwms[1]
+            p._ticks = t = _u16_ticks(v2, p)
+            mem[ccr[1]] = t
+            if n > 2:
+                p = pwms[2]
+                p._ticks = t = _u16_ticks(v3, p)
+                mem[ccr[2]] = t
+                if n > 3:
+                    p = pwms[3]
+                    p._ticks = t = _u16_ticks(v4, p)
+                    mem[ccr[3]] = t
+        stm.mem16[cr1] &= ~_UDIS
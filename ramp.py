@@ -0,0 +1,158 @@
+"""
+Плавное изменение скважности ШИМ без блокирующих циклов с delay().
+Все рампы обслуживаются одним прерыванием таймера; состояние хранится
+в заранее выделенных массивах, а шаг считается в целых числах,
+поэтому обработчик прерывания не выделяет память.
+"""
+from array import array
+
+from pwm import timers
+
+__author__ = "Nikolay Putko"
+__copyright__ = "Nikolay Putko, 2022 onwards."
+__license__ = "MIT https://opensource.org/licenses/MIT (as used by MicroPython)."
+__version__ = "1.0.0"
+
+LINEAR = 0
+EASE_IN = 1
+EASE_OUT = 2
+EASE_IN_OUT = 3
+
+_ONE = 1 << 14  # единица в формате с фиксированной точкой
+
+
+def _curve(curve: int, f: int) -> int:
+    # f и результат - доля пройденного пути от 0 до _ONE
+    if curve == EASE_IN:
+        return f * f >> 14
+    if curve == EASE_OUT:
+        f = _ONE - f
+        return _ONE - (f * f >> 14)
+    if curve == EASE_IN_OUT:
+        return (f * f >> 14) * (3 * _ONE - 2 * f) >> 14
+    return f
+
+
+class Ramper:
+    """
+    Движок плавных переходов скважности для нескольких объектов PWM одновременно
+    """
+    __slots__ = ['freq', '_timer', '_pwms', '_start', '_delta', '_steps', '_step', '_curves']
+
+    def __init__(self, size=8, timer=7, freq=100):
+        """
+        :param size: сколько рамп может идти одновременно
+        :param timer: номер аппаратного таймера для прерывания
+        :param freq: частота шагов в герцах
+        """
+        self.freq = freq
+        self._pwms = [None] * size
+        self._start = array('i', [0] * size)  # начальная скважность, 0-65535
+        self._delta = array('i', [0] * size)  # изменение скважности
+        self._steps = array('i', [0] * size)  # число шагов рампы
+        self._step = array('i', [0] * size)  # пройдено шагов
+        self._curves = bytearray(size)
+        self._timer = timer
+        timers.periodic(timer, freq, self._tick)
+
+    def start(self, pwm, target: int, duration_ms: int, curve=LINEAR) -> None:
+        """
+        Запускает плавный переход скважности pwm к target (0-65535) за duration_ms.
+        Уже идущая рампа этого же pwm заменяется новой.
+        :param curve: LINEAR, EASE_IN, EASE_OUT или EASE_IN_OUT
+        """
+        if target < 0:
+            target = 0
+        elif target > 0xffff:
+            target = 0xffff
+        steps = duration_ms * self.freq // 1000
+        if steps <= 0:
+            self.cancel(pwm)
+            pwm.duty_u16(target)
+            return
+        if steps > 0xffff:
+            steps = 0xffff
+        pwms = self._pwms
+        slot = -1
+        for i in range(len(pwms)):
+            if pwms[i] is pwm:
+                slot = i
+                break
+            if slot < 0 and pwms[i] is None:
+                slot = i
+        if slot < 0:
+            raise RuntimeError('No free ramp slots, increase Ramper size')
+        pwms[slot] = None  # пока слот заполняется, прерывание его пропускает
+        start = pwm.get_u16()
+        self._start[slot] = start
+        self._delta[slot] = target - start
+        self._steps[slot] = steps
+        self._step[slot] = 0
+        self._curves[slot] = curve
+        pwms[slot] = pwm
+
+    def cancel(self, pwm) -> None:
+        """
+        Останавливает рампу pwm на текущей скважности.
+        """
+        pwms = self._pwms
+        for i in range(len(pwms)):
+            if pwms[i] is pwm:
+                pwms[i] = None
+
+    def is_running(self, pwm) -> bool:
+        """
+        Возвращает True, пока у pwm идёт рампа.
+        """
+        return pwm in self._pwms
+
+    def active(self) -> int:
+        """
+        Возвращает число идущих рамп.
+        """
+        return len(self._pwms) - self._pwms.count(None)
+
+    def deinit(self) -> None:
+        """
+        Останавливает все рампы и освобождает таймер.
+        """
+        timers.stop_periodic(self._timer)
+        for i in range(len(self._pwms)):
+            self._pwms[i] = None
+
+    def _tick(self, t):
+        pwms = self._pwms
+        for i in range(len(pwms)):
+            pwm = pwms[i]
+            if pwm is None:
+                continue
+            step = self._step[i] + 1
+            steps = self._steps[i]
+            self._step[i] = step
+            if step >= steps:
+                pwms[i] = None
+                pwm.duty_u16(self._start[i] + self._delta[i])
+            else:
+                f = _curve(self._curves[i], step * _ONE // steps)
+                pwm.duty_u16(self._start[i] + (self._delta[i] * f >> 14))
+
+
+_engine = None
+
+
+def engine() -> Ramper:
+    """
+    Возвращает общий для платы движок рамп, создавая его при первом обращении.
+    """
+    global _engine
+    if _engine is None:
+        _engine = Ramper()
+    return _engine
+
+
+def cancel(pwm) -> None:
+    """
+    Останавливает рампу pwm, если общий движок уже запущен.
+    """
+    if _engine is not None:
+        _engine.cancel(pwm)
@@ -0,0 +1,183 @@
+"""
+Синхронный сбор данных с нескольких аналоговых пинов.
+Все каналы опрашиваются вместе с постоянной частотой, отсчёты складываются
+в кольцевые буферы array('H') по одному на канал с общим индексом,
+так что отсчёты с одинаковым номером относятся к одному моменту времени.
+Датчики (Thermo, LightSensor) могут брать значения из этих буферов
+вместо собственного чтения АЦП, см. SampledADC.use_sampler.
+"""
+from array import array
+
+from pyb import ADC
+
+from pwm import timers
+
+__author__ = "Nikolay Putko"
+__copyright__ = "Nikolay Putko, 2022 onwards."
+__license__ = "MIT https://opensource.org/licenses/MIT (as used by MicroPython)."
+__version__ = "1.1.0"
+
+_COUNT_MASK = (1 << 30) - 1  # счётчик отсчётов остаётся малым целым
+
+
+class ADCSampler:
+    """
+    Опрос набора аналоговых пинов в кольцевые буферы.
+    start() включает непрерывный опрос в прерывании таймера,
+    capture() заполняет буферы целиком одним вызовом ADC.read_timed_multi,
+    где все каналы оцифровываются по одному и тому же событию таймера.
+    """
+    __slots__ = ['pins', 'freq', 'size', 'buffers', 'index', 'count', '_adcs', '_timer', '_tid',
+                 '_running', '_handler']
+
+    def __init__(self, *pins, size=1000, freq=1000, timer=5):
+        """
+        :param pins: аналоговые пины, например 'A0', 'A1'
+        :param size: длина буфера каждого канала в отсчётах
+        :param freq: частота опроса в герцах
+        :param timer: номер аппаратного таймера
+        """
+        self.pins = pins
+        self.freq = freq
+        self.size = size
+        self._adcs = tuple(ADC(pin) for pin in pins)
+        self.buffers = tuple(array('H', [0] * size) for _ in pins)
+        self.index = 0  # куда будет записан следующий отсчёт
+        self.count = 0  # сколько отсчётов записано всего, по модулю 2**30
+        self._running = False
+        # Связанный метод создаётся один раз: start() вызывается повторно, в том числе
+        # из capture(), и не должен каждый раз выделять под него память
+        self._handler = self._tick
+        self._tid = timer
+        self._timer = timers.reserve(timer, freq)
+
+    def channel(self, pin) -> int:
+        """
+        Возвращает номер канала для пина
+        """
+        return self.pins.index(pin)
+
+    def start(self) -> None:
+        """
+        Включает непрерывный опрос в фоне
+        """
+        self._running = True
+        self._timer.callback(self._handler)
+
+    def stop(self) -> None:
+        """
+        Останавливает непрерывный опрос, данные в буферах сохраняются
+        """
+        self._running = False
+        self._timer.callback(None)
+
+    def capture(self) -> bool:
+        """
+        Заполняет буферы всех каналов size отсчётами, взятыми одновременно.
+        Блокирует программу на size / freq секунд.
+        Возвращает False, если АЦП не успевал за таймером и отсчёты пропущены.
+        """
+        running = self._running
+        if running:
+            self.stop()
+        ok = ADC.read_timed_multi(self._adcs, self.buffers, self._timer)
+        self.index = 0
+        self.count = (self.count + self.size) & _COUNT_MASK
+        if running:
+            self.start()
+        return ok
+
+    def deinit(self) -> None:
+        """
+        Останавливает опрос и освобождает таймер
+        """
+        self._running = False
+        timers.stop_periodic(self._tid)
+
+    def _tick(self, t):
+        i = self.index
+        adcs = self._adcs
+        buffers = self.buffers
+        for c in range(len(adcs)):
+            buffers[c][i] = adcs[c].read()
+        i += 1
+        self.index = 0 if i == self.size else i
+        self.count = (self.count + 1) & _COUNT_MASK
+
+    def latest(self, ch: int) -> int:
+        """
+        Возвращает последний отсчёт канала ch
+        """
+        i = self.index - 1
+        return self.buffers[ch][i if i >= 0 else self.size - 1]
+
+    def sum(self, ch: int, n: int) -> int:
+        """
+        Возвращает сумму последних n отсчётов канала ch, n не больше size
+        """
+        buf = self.buffers[ch]
+        i = self.index
+        total = 0
+        for _ in range(n):
+            i -= 1
+            if i < 0:
+                i = self.size - 1
+            total += buf[i]
+        return total
+
+    def mean(self, ch: int, n: int) -> int:
+        """
+        Возвращает среднее последних n отсчётов канала ch, округлённое вниз
+        """
+        return self.sum(ch, n) // n
+
+    def snapshot(self, ch: int, out) -> None:
+        """
+        Копирует последние len(out) отсчётов канала ch в out от старых к новым,
+        например для записи в файл, пока опрос продолжается
+        """
+        buf = self.buffers[ch]
+        n = len(out)
+        i = self.index - n
+        if i < 0:
+            i += self.size
+        for j in range(n):
+            out[j] = buf[i]
+            i += 1
+            if i == self.size:
+                i = 0
+
+
+class SampledADC:
+    """
+    Примесь для датчиков на основе pyb.ADC: после use_sampler() read()
+    берёт отсчёты из буфера ADCSampler вместо собственного чтения АЦП.
+    Ставится в базовых классах перед ADC: class Thermo(SampledADC, ADC).
+    """
+    _sampler = None  # ADCSampler, из буфера которого берутся отсчёты
+    _channel = 0
+    _window = 1
+
+    def use_sampler(self, sampler, pin, samples=1) -> None:
+        """
+        Брать отсчёты из буфера ADCSampler вместо собственного чтения АЦП.
+        :param sampler: ADCSampler, опрашивающий пин датчика
+        :param pin: пин датчика, None - снова читать АЦП самому
+        :param samples: сколько последних отсчётов усреднять
+        """
+        if pin is None:
+            self._sampler = None
+            return
+        self._sampler = sampler
+        self._channel = sampler.channel(pin)
+        self._window = samples
+
+    def read(self) -> int:
+        """
+        Возвращает отсчёт АЦП, последний из буфера ADCSampler, если он подключён
+        """
+        sampler = self._sampler
+        if sampler is None:
+            # Явно, а не через super(): в MicroPython super() примеси не идёт дальше по MRO
+            return ADC.read(self)
+        return sampler.mean(self._channel, self._window)
@@ -2,48 +2,297 @@
 Класс для реализации работы микросервоприводов с платой IskraJS с micropython 1.13
 Поддерживаемые сервоприводы: Feetech FS90
 """
-from pwm import PWM
+import struct
+from array import array
+
+from micropython import schedule
+from pwm import PWM, timers
 
 __author__ = "Nikolay Putko"
 __copyright__ = "Nikolay Putko, 2022 onwards."
 __license__ = "MIT https://opensource.org/licenses/MIT (as used by MicroPython)."
-__version__ = "1.0.0"
+__version__ = "1.3.2"
+
+CALIBRATION_FILE = 'servo.cal'
+# Запись калибровки: имя пина, импульсы для 0 и 180 градусов и поправка середины, мкс
+_RECORD = '4sHHh'
+_calibration = None
+
+
+def load_calibration(file_name=CALIBRATION_FILE) -> dict:
+    """
+    Читает файл калибровки целиком одним вызовом и возвращает словарь
+    {пин: (min_us, max_us, center_us)}. Нет файла - нет калибровки.
+    """
+    global _calibration
+    _calibration = {}
+    try:
+        with open(file_name, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return _calibration
+    size = struct.calcsize(_RECORD)
+    for offset in range(0, len(data) - size + 1, size):
+        pin, min_us, max_us, center_us = struct.unpack_from(_RECORD, data, offset)
+        _calibration[pin.rstrip(b'\0').decode()] = (min_us, max_us, center_us)
+    return _calibration
+
+
+def save_calibration(file_name=CALIBRATION_FILE) -> None:
+    """
+    Сохраняет калибровку всех сервоприводов в файл.
+    """
+    if _calibration is None:
+        load_calibration(file_name)
+    with open(file_name, 'wb') as f:
+        for pin, (min_us, max_us, center_us) in _calibration.items():
+            f.write(struct.pack(_RECORD, pin.encode(), min_us, max_us, center_us))
+
 
-def _convert_from_angle_to_duty(angles: int):
+def calibration(pin: str):
     """
-    Преобразует угол в ШИМ-процент
+    Возвращает (min_us, max_us, center_us) для пина или None.
+    Файл калибровки читается при первом обращении.
     """
-    dmin = 2.5
-    dmax = 12.5
-    delta = dmax - dmin
-    if angles <= 0:
-        angles = 0
-    if angles >= 180:
-        angles = 180
-    val = dmin + angles * int(delta / 180 * 100) / 100
-    return val
+    if _calibration is None:
+        load_calibration()
+    return _calibration.get(pin)
+
+
+class _ServoPWM(PWM):
+    """
+    ШИМ сервопривода: после смены частоты таймера другим пином
+    таблица импульсов пересчитывается под новый период.
+    """
+    __slots__ = ['servo']
+    exact_freq = True  # длительности импульсов рассчитаны на 50 Гц
+
+    def _rescale(self, freq: int) -> None:
+        super()._rescale(freq)
+        servo = self.servo
+        if servo is not None:
+            servo._build_table()
+            servo._write(servo._index(servo._angle))
 
 
 class ServoFS90:
     """
     Класс работы с микросервоприводом Feetech FS90
     """
-    __slots__ = ['_servo', '_angle']
+    __slots__ = ['_servo', '_angle', '_table', '_steps', '_min_us', '_max_us', '_center_us']
+    MIN_PULSE_US = 500  # импульс для 0 градусов
+    MAX_PULSE_US = 2500  # импульс для 180 градусов
 
-    def __init__(self, pin: str):
-        self._servo = PWM(pin, freq=50, width=5)
+    def __init__(self, pin: str, min_us=None, max_us=None, resolution=1):
+        """
+        :param min_us: длительность импульса для 0 градусов; по умолчанию
+                       из файла калибровки, а без неё MIN_PULSE_US
+        :param max_us: длительность импульса для 180 градусов; по умолчанию
+                       из файла калибровки, а без неё MAX_PULSE_US
+        :param resolution: число шагов таблицы на градус, 2 - точность полградуса и т.д.
+        """
+        self._servo = _ServoPWM(pin, freq=50, width=5)
+        self._servo.servo = None  # таблицы ещё нет, пересчитывать нечего
+        self._min_us = self.MIN_PULSE_US
+        self._max_us = self.MAX_PULSE_US
+        self._center_us = 0
+        cal = calibration(pin) if min_us is None and max_us is None else None
+        if cal is not None:
+            self._min_us, self._max_us, self._center_us = cal
+        if min_us is not None:
+            self._min_us = min_us
+        if max_us is not None:
+            self._max_us = max_us
+        self._steps = resolution
+        self._build_table()
         self._angle = 0
+        self._servo.servo = self
         self.set_angle(0)
 
+    def _build_table(self):
+        # Длительности импульсов в тиках таймера для каждого шага угла:
+        # две прямые 0-90 и 90-180 градусов, середина сдвинута на center_us.
+        # Импульс не длиннее периода, даже если таймер перенастроен на другую частоту
+        period_us = 1000000 // self._servo.freq
+        period = self._servo.period_ticks()
+        half = 90 * self._steps
+        lo = self._min_us
+        hi = self._max_us
+        mid = (lo + hi) // 2 + self._center_us
+        table = array('I', [0] * (2 * half + 1))
+        for i in range(2 * half + 1):
+            if i <= half:
+                us = lo * half + (mid - lo) * i
+            else:
+                us = mid * half + (hi - mid) * (i - half)
+            ticks = us * period // (period_us * half)
+            table[i] = ticks if ticks < period else period
+        self._table = table
+
+    def calibrate(self, min_us: int, max_us: int, center_us=0, save=True) -> None:
+        """
+        Задаёт калибровку этого сервопривода и пересчитывает таблицу.
+        :param min_us: импульс для 0 градусов
+        :param max_us: импульс для 180 градусов
+        :param center_us: поправка импульса для 90 градусов
+        :param save: сохранить калибровку в файл, чтобы она загружалась при старте
+        """
+        self._min_us = min_us
+        self._max_us = max_us
+        self._center_us = center_us
+        self._build_table()
+        self.set_angle(self._angle)
+        if _calibration is None:
+            load_calibration()
+        _calibration[self._servo.pin] = (min_us, max_us, center_us)
+        if save:
+            save_calibration()
+
+    def _index(self, angle) -> int:
+        # Номер шага таблицы для угла
+        i = int(angle * self._steps)
+        if i <= 0:
+            return 0
+        if i >= len(self._table):
+            return len(self._table) - 1
+        return i
+
+    def _write(self, i: int) -> None:
+        ticks = self._table[i]
+        servo = self._servo
+        servo._ticks = ticks
+        servo.cnl.pulse_width(ticks)
+
     def set_angle(self, angle):
         """
         Устанавливает угол поворота
         """
         self._angle = angle
-        self._servo.duty(_convert_from_angle_to_duty(angle))
+        self._write(self._index(angle))
 
     def get_angle(self):
         """
         Возвращает текущий угол
         """
         return self._angle
+
+
+_ONE = 1 << 14  # единица в формате с фиксированной точкой
+
+
+class ServoMotion:
+    """
+    Плавное согласованное движение нескольких сервоприводов.
+    Каждый сервопривод идёт по трапециевидному профилю скорости (разгон,
+    равномерное движение, торможение), и все приходят к цели одновременно.
+    Шаги выполняются в прерывании таймера, основной цикл остаётся свободным.
+    """
+    __slots__ = ['freq', 'accel', 'done', '_timer', '_servos', '_targets', '_start', '_delta',
+                 '_steps', '_ramp', '_step', '_callback']
+
+    def __init__(self, *servos: ServoFS90, timer=9, freq=50, accel=25):
+        """
+        :param timer: номер аппаратного таймера для прерывания
+        :param freq: частота шагов в герцах, для сервоприводов больше 50 не нужно
+        :param accel: доля времени движения в процентах на разгон и столько же на торможение, до 50
+        """
+        n = len(servos)
+        self.freq = freq
+        self.accel = accel
+        self.done = True
+        self._servos = servos
+        self._targets = [0] * n
+        self._start = array('i', [0] * n)  # начальные шаги таблиц
+        self._delta = array('i', [0] * n)
+        self._steps = 0  # длительность движения в шагах прерывания
+        self._ramp = 0  # длительность разгона в шагах
+        self._step = 0
+        self._callback = None
+        self._timer = timer
+        timers.periodic(timer, freq, self._tick)
+
+    def move(self, *angles, duration_ms=0, speed=0, callback=None) -> None:
+        """
+        Запускает движение сервоприводов к углам angles (в порядке сервоприводов).
+        :param duration_ms: время движения
+        :param speed: вместо времени - предельная скорость в градусах в секунду
+        :param callback: вызывается через micropython.schedule, когда все пришли к цели
+        """
+        servos = self._servos
+        if len(angles) != len(servos):
+            raise ValueError('ServoMotion.move needs one angle per servo')
+        self._steps = 0  # пока движение настраивается, прерывание его пропускает
+        longest = 0
+        for i in range(len(servos)):
+            servo = servos[i]
+            start = servo._index(servo.get_angle())
+            delta = servo._index(angles[i]) - start
+            self._targets[i] = angles[i]
+            self._start[i] = start
+            self._delta[i] = delta
+            longest = max(longest, abs(delta) // servo._steps)
+        if speed:
+            # Пиковая скорость трапеции выше средней в 100 / (100 - accel) раз
+            duration_ms = max(duration_ms, longest * 100000 // (speed * (100 - self.accel)))
+        steps = duration_ms * self.freq // 1000
+        if steps > 32767:
+            steps = 32767
+        self._callback = callback
+        self._step = 0
+        self.done = False
+        if steps <= 0:
+            for i in range(len(servos)):
+                servos[i].set_angle(angles[i])
+            self._finish()
+            return
+        self._ramp = steps * min(self.accel, 50) // 100
+        self._steps = steps
+
+    def stop(self) -> None:
+        """
+        Прерывает движение; сервоприводы остаются там, где были.
+        """
+        self._steps = 0
+        self.done = True
+
+    def deinit(self) -> None:
+        """
+        Останавливает движение и освобождает таймер.
+        """
+        self.stop()
+        timers.stop_periodic(self._timer)
+
+    def _finish(self):
+        self._steps = 0
+        self.done = True
+        if self._callback is not None:
+            schedule(self._callback, self)
+
+    def _tick(self, t):
+        steps = self._steps
+        if not steps:
+            return
+        k = self._step + 1
+        self._step = k
+        servos = self._servos
+        if k >= steps:
+            for i in range(len(servos)):
+                servo = servos[i]
+                servo._angle = self._targets[i]
+                servo._write(self._start[i] + self._delta[i])
+            self._finish()
+            return
+        # Путь по трапеции скоростей в удвоенных шагах, затем доля от 0 до _ONE
+        r = self._ramp
+        if k <= r:
+            pos = k * k // r
+        elif k < steps - r:
+            pos = 2 * k - r
+        else:
+            pos = 2 * (steps - r) - (steps - k) * (steps - k) // r
+        f = pos * _ONE // (2 * (steps - r))
+        for i in range(len(servos)):
+            servo = servos[i]
+            index = self._start[i] + (self._delta[i] * f >> 14)
+            servo._angle = index // servo._steps
+            servo._write(index)
@@ -0,0 +1,63 @@
+"""
+Эмулятор аппаратной части IskraJS для запуска драйверов на компьютере.
+Подменяет модули pyb, machine, utime, stm, micropython и дополняет time
+функциями MicroPython, поэтому драйверы импортируются без изменений:
+
+    import sim
+    sim.install()
+    from ultrasonic import Ultrasonic
+    sim.devices.HCSR04('P12', 'P10', distance_cm=42)
+    Ultrasonic('P12', 'P10').distance_in_cm()
+
+Все задержки идут по виртуальным часам sim.board, а переключения пинов
+и настройки ШИМ записываются в журнал sim.board.log.
+"""
+import sys
+import types
+
+from . import devices, machine, micropython, pyb, stm, utime
+from .board import board
+
+_saved = {}
+
+
+def _time_module():
+    # time из CPython, дополненный функциями utime на виртуальных часах
+    import time as host_time
+    module = types.ModuleType('time')
+    module.__dict__.update(host_time.__dict__)
+    for name in ('sleep', 'sleep_ms', 'sleep_us', 'ticks_us', 'ticks_ms', 'ticks_cpu',
+                 'ticks_add', 'ticks_diff'):
+        setattr(module, name, getattr(utime, name))
+    return module
+
+
+def install():
+    """
+    Регистрирует модули эмулятора вместо модулей платы.
+    """
+    modules = {'pyb': pyb, 'machine': machine, 'utime': utime, 'stm': stm,
+               'micropython': micropython, 'time': _time_module()}
+    for name, module in modules.items():
+        if name not in _saved:
+            _saved[name] = sys.modules.get(name)
+        sys.modules[name] = module
+
+
+def uninstall():
+    """
+    Возвращает модули, бывшие до install.
+    """
+    for name, module in _saved.items():
+        if module is None:
+            sys.modules.pop(name, None)
+        else:
+            sys.modules[name] = module
+    _saved.clear()
+
+
+def reset():
+    """
+    Сбрасывает время, пины, аналоговые входы и журнал платы.
+    """
+    board.reset()
@@ -0,0 +1,204 @@
+"""
+Виртуальная плата: часы в микросекундах, очередь событий, состояние пинов
+и журнал всех переключений пинов и настроек ШИМ.
+"""
+import heapq
+
+GPIO_BASE = 0x40020000
+GPIO_STEP = 0x400
+TIM_BASE = {2: 0x40000000, 3: 0x40000400, 4: 0x40000800, 5: 0x40000c00}
+TIM_CCR1 = 0x34
+
+# Пины IskraJS: порт (0 - A, 1 - B, 2 - C) и номер бита, см. pins/pinout.png
+PINOUT = {
+    'P0': (1, 11), 'P1': (1, 10), 'P2': (0, 6), 'P3': (0, 7),
+    'P4': (2, 3), 'P5': (1, 1), 'P6': (1, 0), 'P7': (2, 2),
+    'P8': (2, 6), 'P9': (2, 7), 'P10': (2, 8), 'P11': (2, 9),
+    'P12': (0, 8), 'P13': (0, 10),
+    'A0': (0, 0), 'A1': (0, 1), 'A2': (0, 2), 'A3': (0, 3), 'A4': (0, 4), 'A5': (0, 5),
+    'SCL': (1, 8), 'SDA': (1, 9), 'LED1': (1, 6), 'LED2': (1, 7), 'BTN1': (2, 4),
+}
+
+
+class PinState:
+    """
+    Физическое состояние пина, общее для всех объектов Pin с тем же именем
+    """
+    __slots__ = ['name', 'value', 'output', 'handlers', 'watchers']
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        self.output = False  # выходы управляются регистрами ODR и BSRR
+        self.handlers = []  # [(Pin, handler, trigger)] - прерывания machine.Pin.irq
+        self.watchers = []  # модели внешних устройств: fn(state, value)
+
+
+class Board:
+    """
+    Состояние виртуальной платы
+    """
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+
+    def __init__(self):
+        self.memory = {}  # адрес -> значение регистров, кроме GPIO, в том числе TIMx_CCRn
+        self.reset()
+
+    def reset(self):
+        """
+        Возвращает плату в начальное состояние: время 0, пустые очередь и журнал.
+        """
+        self.now = 0
+        self.record = True
+        self.log = []
+        self.pins = {}
+        self.analog = {}  # имя пина -> число или функция от времени в мкс
+        self.memory.clear()  # очищается на месте: модуль stm держит ссылку на него
+        self._by_bit = {}
+        for name, (port, bit) in PINOUT.items():
+            self._by_bit[(port, bit)] = name
+        self._queue = []
+        self._seq = 0
+
+    # --- журнал ---
+
+    def record_event(self, kind, name, value):
+        """
+        Добавляет запись (время, вид, имя, значение) в журнал.
+        """
+        if self.record:
+            self.log.append((self.now, kind, name, value))
+
+    def events(self, kind=None, name=None):
+        """
+        Возвращает записи журнала, отфильтрованные по виду и имени.
+        """
+        return [e for e in self.log
+                if (kind is None or e[1] == kind) and (name is None or e[2] == name)]
+
+    # --- время и события ---
+
+    def schedule(self, delay_us, fn, *args):
+        """
+        Планирует вызов fn(*args) через delay_us микросекунд.
+        Возвращает дескриптор, который можно передать в cancel.
+        """
+        self._seq += 1
+        entry = [self.now + max(0, int(delay_us)), self._seq, fn, args]
+        heapq.heappush(self._queue, entry)
+        return entry
+
+    @staticmethod
+    def cancel(entry):
+        """
+        Отменяет запланированное событие.
+        """
+        if entry is not None:
+            entry[2] = None
+
+    def _step(self):
+        entry = heapq.heappop(self._queue)
+        if entry[2] is not None:
+            self.now = entry[0]
+            entry[2](*entry[3])
+
+    def run(self, until):
+        """
+        Выполняет все события до момента until (мкс) и переводит часы на него.
+        """
+        while self._queue and self._queue[0][0] <= until:
+            self._step()
+        if until > self.now:
+            self.now = until
+
+    def advance(self, us):
+        """
+        Продвигает часы на us микросекунд, выполняя события по пути.
+        """
+        self.run(self.now + int(us))
+
+    def run_until(self, cond, deadline):
+        """
+        Выполняет события, пока cond() не станет истинным или не наступит deadline.
+        Возвращает итоговое значение cond().
+        """
+        while not cond():
+            if not self._queue or self._queue[0][0] > deadline:
+                if deadline > self.now:
+                    self.now = deadline
+                return cond()
+            self._step()
+        return True
+
+    # --- пины ---
+
+    def pin(self, name):
+        """
+        Возвращает состояние пина, создавая его при первом обращении.
+        """
+        state = self.pins.get(name)
+        if state is None:
+            state = PinState(name)
+            self.pins[name] = state
+        return state
+
+    def set_pin(self, name, value):
+        """
+        Устанавливает уровень пина, записывает переход в журнал,
+        оповещает модели устройств и вызывает обработчики прерываний.
+        """
+        state = self.pin(name)
+        value = 1 if value else 0
+        if state.value == value:
+            return
+        state.value = value
+        self.record_event('pin', name, value)
+        for watcher in state.watchers:
+            watcher(state, value)
+        edge = self.IRQ_RISING if value else self.IRQ_FALLING
+        for pin, handler, trigger in state.handlers:
+            if trigger & edge:
+                handler(pin)
+
+    def read_port(self, port):
+        """
+        Возвращает уровни пинов порта в виде 16-битной маски.
+        """
+        value = 0
+        for bit in range(16):
+            name = self._by_bit.get((port, bit))
+            if name is not None and self.pin(name).value:
+                value |= 1 << bit
+        return value
+
+    def write_port(self, port, set_mask, reset_mask):
+        """
+        Устанавливает и сбрасывает пины порта по маскам, как регистр BSRR.
+        Пины, не настроенные как выходы, не меняются.
+        """
+        for bit in range(16):
+            name = self._by_bit.get((port, bit))
+            if name is None or not self.pin(name).output:
+                continue
+            if set_mask >> bit & 1:
+                self.set_pin(name, 1)
+            elif reset_mask >> bit & 1:
+                self.set_pin(name, 0)
+
+    def read_analog(self, name):
+        """
+        Возвращает 12-битное значение на аналоговом входе.
+        """
+        source = self.analog.get(name, 0)
+        if callable(source):
+            source = source(self.now)
+        source = int(source)
+        if source < 0:
+            return 0
+        if source > 4095:
+            return 4095
+        return source
+
+
+board = Board()
@@ -0,0 +1,147 @@
+"""
+Модели внешних устройств, подключаемых к виртуальной плате
+"""
+from .board import board
+
+
+class HCSR04:
+    """
+    Ультразвуковой дальномер: после импульса на trigger выдаёт на echo
+    импульс длительностью, соответствующей расстоянию distance_cm.
+    """
+    ECHO_DELAY_US = 450  # задержка перед началом эхо-импульса
+    NO_ECHO_US = 38000  # длительность импульса, когда препятствия нет
+
+    def __init__(self, trigger, echo, distance_cm=100, max_cm=400, speed_of_sound=343):
+        self.echo = echo
+        self.distance_cm = distance_cm
+        self.max_cm = max_cm
+        self.speed_of_sound = speed_of_sound  # м/с
+        self.pings = 0
+        board.pin(trigger).watchers.append(self._on_trigger)
+
+    def pulse_us(self):
+        """
+        Длительность эхо-импульса для текущего расстояния.
+        """
+        if self.distance_cm is None or self.distance_cm > self.max_cm:
+            return self.NO_ECHO_US
+        return int(self.distance_cm * 20000 / self.speed_of_sound)
+
+    def _on_trigger(self, state, value):
+        if value:
+            return
+        self.pings += 1
+        board.schedule(self.ECHO_DELAY_US, board.set_pin, self.echo, 1)
+        board.schedule(self.ECHO_DELAY_US + self.pulse_us(), board.set_pin, self.echo, 0)
+
+
+class NECRemote:
+    """
+    ИК-пульт с протоколом NEC. Уровни на выходе приёмника инвертированы:
+    в покое 1, во время посылки 0.
+    """
+    MARK_US = 562
+    ONE_SPACE_US = 1687
+    ZERO_SPACE_US = 562
+
+    def __init__(self, pin):
+        self.pin = pin
+        board.pin(pin).value = 1  # уровень покоя, а не фронт
+
+    @classmethod
+    def edges(cls, addr, cmd, start=0):
+        """
+        Возвращает моменты всех 68 фронтов посылки addr/cmd в мкс.
+        Адрес длиннее 8 бит передаётся как расширенный.
+        """
+        if addr > 0xff:
+            data = addr | (cmd << 16) | ((cmd ^ 0xff) << 24)
+        else:
+            data = addr | ((addr ^ 0xff) << 8) | (cmd << 16) | ((cmd ^ 0xff) << 24)
+        t = start
+        times = [t]
+        t += 9000
+        times.append(t)
+        t += 4500
+        for _ in range(32):
+            times.append(t)
+            t += cls.MARK_US
+            times.append(t)
+            t += cls.ONE_SPACE_US if data & 1 else cls.ZERO_SPACE_US
+            data >>= 1
+        times.append(t)
+        times.append(t + cls.MARK_US)
+        return times
+
+    @classmethod
+    def repeat_edges(cls, start=0):
+        """
+        Возвращает моменты четырёх фронтов кода повтора.
+        """
+        return [start, start + 9000, start + 11250, start + 11250 + cls.MARK_US]
+
+    def _play(self, times):
+        level = 0
+        for t in times:
+            board.schedule(t, board.set_pin, self.pin, level)
+            level ^= 1
+
+    def send(self, addr, cmd):
+        """
+        Запускает передачу команды с текущего момента.
+        """
+        self._play(self.edges(addr, cmd))
+
+    def repeat(self):
+        """
+        Запускает передачу кода повтора.
+        """
+        self._play(self.repeat_edges())
+
+
+def thermometer(pin, celsius):
+    """
+    Подключает к аналоговому пину термометр TMP36 (10 мВ/°C, 500 мВ при 0 °C).
+    celsius может быть числом или функцией от времени в мкс.
+    """
+    def source(now):
+        c = celsius(now) if callable(celsius) else celsius
+        return (c + 50) / 100 / 3.3 * 4096
+    board.analog[pin] = source
+
+
+def wheel_encoder(pin_a, rpm, cpr=20, pin_b=None, step_us=1000):
+    """
+    Подключает энкодер колеса: на pin_a идут cpr импульсов за оборот,
+    на pin_b (если задан) - те же импульсы со сдвигом на четверть периода.
+    rpm может быть числом или функцией от времени в мкс и пересчитывается
+    каждые step_us. Отрицательные обороты - вращение назад, канал B тогда
+    опережает канал A.
+    """
+    levels = ((0, 0), (1, 0), (1, 1), (0, 1))  # (A, B) для каждой четверти импульса
+    state = [0.0]  # положение колеса в четвертях импульса
+
+    def edge(q):
+        a, b = levels[q % 4]
+        board.set_pin(pin_a, a)
+        if pin_b is not None:
+            board.set_pin(pin_b, b)
+
+    def step():
+        r = rpm(board.now) if callable(rpm) else rpm
+        pos = state[0]
+        speed = r * cpr * 4 / 60000000  # четвертей импульса за мкс
+        new = pos + speed * step_us
+        q = int(pos // 1)
+        if speed > 0:
+            while q + 1 <= new:
+                q += 1
+                board.schedule(int((q - pos) / speed), edge, q)
+        elif speed < 0:
+            while q > new:
+                board.schedule(int((q - pos) / speed), edge, q - 1)
+                q -= 1
+        state[0] = new
+        board.schedule(step_us, step)
+    board.schedule(0, step)
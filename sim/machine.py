@@ -0,0 +1,148 @@
+"""
+Эмуляция модуля machine
+"""
+from .board import GPIO_BASE, GPIO_STEP, PINOUT, board
+
+
+def _pin_name(id):
+    return id.id if isinstance(id, Pin) else id
+
+
+class Pin:
+    """
+    Цифровой пин платы
+    """
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    ALT = 3
+    ALT_OPEN_DRAIN = 4
+    ANALOG = 5
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = board.IRQ_FALLING
+    IRQ_RISING = board.IRQ_RISING
+
+    def __init__(self, id, mode=-1, pull=-1, value=None, **kwargs):
+        self.id = _pin_name(id)
+        self.mode = self.IN
+        self.pull = None
+        self._state = board.pin(self.id)
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None, **kwargs):
+        if mode != -1:
+            self.mode = mode
+            self._state.output = mode in (self.OUT, self.OPEN_DRAIN)
+        if pull != -1:
+            self.pull = pull
+        if value is not None:
+            self.value(value)
+
+    def value(self, v=None):
+        if v is None:
+            return self._state.value
+        board.set_pin(self.id, v)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def high(self):
+        self.value(1)
+
+    def low(self):
+        self.value(0)
+
+    def name(self):
+        return self.id
+
+    def port(self):
+        return PINOUT[self.id][0]
+
+    def pin(self):
+        return PINOUT[self.id][1]
+
+    def gpio(self):
+        return GPIO_BASE + GPIO_STEP * PINOUT[self.id][0]
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, **kwargs):
+        handlers = self._state.handlers
+        handlers[:] = [h for h in handlers if h[0] is not self]
+        if handler is not None:
+            handlers.append((self, handler, trigger))
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def __repr__(self):
+        return 'Pin(' + repr(self.id) + ')'
+
+
+def time_pulse_us(pin, pulse_level, timeout_us=1000000):
+    """
+    Ждёт уровень pulse_level на пине и измеряет длительность импульса.
+    -2 - импульс не начался, -1 - импульс не закончился за timeout_us.
+    """
+    state = board.pin(_pin_name(pin))
+    start = board.now
+    if not board.run_until(lambda: state.value == pulse_level, start + timeout_us):
+        return -2
+    start = board.now
+    if not board.run_until(lambda: state.value != pulse_level, start + timeout_us):
+        return -1
+    return board.now - start
+
+
+class Timer:
+    """
+    Программный таймер machine.Timer
+    """
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self.id = id
+        self._mode = self.PERIODIC
+        self._period_us = 0
+        self._callback = None
+        self._entry = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=-1, freq=-1, callback=None, **kwargs):
+        self.deinit()
+        self._mode = mode
+        self._period_us = 1000000 // freq if freq > 0 else period * 1000
+        self._callback = callback
+        self._entry = board.schedule(self._period_us, self._expire)
+
+    def _expire(self):
+        if self._mode == self.PERIODIC:
+            self._entry = board.schedule(self._period_us, self._expire)
+        else:
+            self._entry = None
+        if self._callback is not None:
+            self._callback(self)
+
+    def deinit(self):
+        board.cancel(self._entry)
+        self._entry = None
+
+
+def freq():
+    return 168000000
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
+
+
+def unique_id():
+    return b'\x49\x73\x6b\x72\x61\x4a\x53\x00\x00\x00\x00\x01'
@@ -0,0 +1,27 @@
+"""
+Эмуляция модуля micropython
+"""
+
+
+def const(expr):
+    return expr
+
+
+def schedule(func, arg):
+    func(arg)
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def mem_info(verbose=False):
+    pass
+
+
+def heap_lock():
+    pass
+
+
+def heap_unlock():
+    return 0
@@ -0,0 +1,292 @@
+"""
+Эмуляция модуля pyb
+"""
+from .board import TIM_BASE, TIM_CCR1, board
+from .machine import Pin
+
+
+class TimerChannel:
+    """
+    Канал аппаратного таймера
+    """
+
+    def __init__(self, timer, channel, mode, pin=None):
+        self.timer = timer
+        self.channel = channel
+        self.mode = mode
+        self.pin = pin
+        self.name = pin.id if pin is not None else 'T' + str(timer.id) + 'CH' + str(channel)
+        # Значение сравнения лежит в памяти платы, у TIM2-TIM5 по адресу регистра
+        # TIMx_CCRn, поэтому запись через stm.mem32 видна в pulse_width() и наоборот
+        if timer.id in TIM_BASE:
+            self._addr = TIM_BASE[timer.id] + TIM_CCR1 + 4 * (channel - 1)
+        else:
+            self._addr = ('CCR', timer.id, channel)
+        board.memory[self._addr] = 0
+        self._callback = None
+
+    def pulse_width(self, value=None):
+        if value is None:
+            return board.memory.get(self._addr, 0)
+        value = int(value)
+        board.memory[self._addr] = value
+        board.record_event('pwm', self.name, value)
+
+    def pulse_width_percent(self, value=None):
+        period = self.timer._period + 1
+        if value is None:
+            return self.pulse_width() * 100 / period
+        if isinstance(value, float):
+            self.pulse_width(value / 100 * period)
+        else:
+            self.pulse_width(period * value // 100)
+
+    compare = pulse_width
+
+    def capture(self, value=None):
+        return self.pulse_width(value)
+
+    def callback(self, fun):
+        self._callback = fun
+
+
+class Timer:
+    """
+    Аппаратный таймер STM32F405: предделитель, период, каналы и прерывание
+    по переполнению, которое выполняется на виртуальных часах платы.
+    """
+    PWM = 0
+    PWM_INVERTED = 1
+    OC_TIMING = 2
+    OC_ACTIVE = 3
+    OC_INACTIVE = 4
+    OC_TOGGLE = 5
+    OC_FORCED_ACTIVE = 6
+    OC_FORCED_INACTIVE = 7
+    IC = 8
+    ENC_A = 9
+    ENC_B = 10
+    ENC_AB = 11
+    UP = 0
+    DOWN = 16
+    CENTER = 32
+    HIGH = 0
+    LOW = 2
+    RISING = 0
+    FALLING = 2
+    BOTH = 10
+
+    def __init__(self, id, **kwargs):
+        self.id = id
+        self._prescaler = 0
+        self._period = 0xffff
+        self._channels = {}
+        self._callback = None
+        self._entry = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def __repr__(self):
+        return 'Timer(' + str(self.id) + ')'
+
+    def _counter_max(self):
+        # Таймеры 2 и 5 - 32-битные, остальные 16-битные
+        return 0xffffffff if self.id in (2, 5) else 0xffff
+
+    def source_freq(self):
+        # Таймеры на шине APB2 тактируются вдвое быстрее
+        return 168000000 if self.id in (1, 8, 9, 10, 11) else 84000000
+
+    def _update_period_us(self):
+        return max(1, (self._prescaler + 1) * (self._period + 1) * 1000000 // self.source_freq())
+
+    def _arm(self):
+        board.cancel(self._entry)
+        self._entry = None
+        if self._callback is not None:
+            self._entry = board.schedule(self._update_period_us(), self._update)
+
+    def _update(self):
+        self._entry = board.schedule(self._update_period_us(), self._update)
+        self._callback(self)
+
+    def init(self, freq=None, prescaler=None, period=None, callback=None, **kwargs):
+        if freq is not None:
+            self.freq(freq)
+        else:
+            if prescaler is not None:
+                self._prescaler = prescaler
+            if period is not None:
+                self._period = period
+            board.record_event('timer', 'T' + str(self.id), self.freq())
+        self._callback = callback
+        self._arm()
+
+    def deinit(self):
+        self._callback = None
+        self._arm()
+        self._channels = {}
+
+    def freq(self, value=None):
+        if value is None:
+            return self.source_freq() // (self._prescaler + 1) // (self._period + 1)
+        period = self.source_freq() // value
+        if period < 1:
+            raise ValueError('freq too large')
+        prescaler = 1
+        while period > self._counter_max():
+            prescaler <<= 1
+            period >>= 1
+        self._prescaler = prescaler - 1
+        self._period = period - 1
+        board.record_event('timer', 'T' + str(self.id), value)
+        if self._callback is not None:
+            self._arm()
+
+    def prescaler(self, value=None):
+        if value is None:
+            return self._prescaler
+        self._prescaler = value
+        if self._callback is not None:
+            self._arm()
+
+    def period(self, value=None):
+        if value is None:
+            return self._period
+        self._period = value
+        if self._callback is not None:
+            self._arm()
+
+    def counter(self, value=None):
+        if value is None:
+            ticks = board.now * self.source_freq() // 1000000 // (self._prescaler + 1)
+            return ticks % (self._period + 1)
+
+    def callback(self, fun):
+        self._callback = fun
+        self._arm()
+
+    def channel(self, channel, mode=None, pin=None, **kwargs):
+        if mode is None:
+            return self._channels.get(channel)
+        if pin is not None:
+            pin.init(Pin.ALT)
+        ch = TimerChannel(self, channel, mode, pin)
+        self._channels[channel] = ch
+        if 'pulse_width' in kwargs:
+            ch.pulse_width(kwargs['pulse_width'])
+        elif 'pulse_width_percent' in kwargs:
+            ch.pulse_width_percent(kwargs['pulse_width_percent'])
+        return ch
+
+
+def _freq_of(timer):
+    return timer.freq() if isinstance(timer, Timer) else timer
+
+
+class ADC:
+    """
+    12-битный АЦП. Значения берутся из board.analog
+    """
+
+    def __init__(self, pin):
+        self.pin = pin.id if isinstance(pin, Pin) else pin
+
+    def read(self):
+        return board.read_analog(self.pin)
+
+    def read_timed(self, buf, timer):
+        """
+        Заполняет buf отсчётами с частотой таймера; часы уходят вперёд,
+        как и на плате, где вызов блокирующий.
+        """
+        step = 1000000 // _freq_of(timer)
+        for i in range(len(buf)):
+            if i:
+                board.advance(step)
+            buf[i] = board.read_analog(self.pin)
+
+    @staticmethod
+    def read_timed_multi(adcs, bufs, timer):
+        """
+        Заполняет буферы отсчётами нескольких АЦП, снятыми по одним и тем же
+        событиям таймера. Возвращает True: отсчёты в эмуляторе не опаздывают.
+        """
+        step = 1000000 // _freq_of(timer)
+        for i in range(len(bufs[0])):
+            if i:
+                board.advance(step)
+            for adc, buf in zip(adcs, bufs):
+                buf[i] = board.read_analog(adc.pin)
+        return True
+
+
+class DAC:
+    """
+    ЦАП. Записанные значения попадают в журнал платы
+    """
+
+    def __init__(self, port, bits=8, **kwargs):
+        self.port = port
+        self.bits = bits
+        self.name = 'DAC' + str(port)
+
+    def init(self, bits=8, **kwargs):
+        self.bits = bits
+
+    def deinit(self):
+        pass
+
+    def write(self, value):
+        board.record_event('dac', self.name, value)
+
+    def write_timed(self, data, freq, mode=None):
+        step = 1000000 // _freq_of(freq)
+        for i, value in enumerate(data):
+            board.schedule(i * step, self.write, value)
+
+    def noise(self, freq):
+        pass
+
+    def triangle(self, freq):
+        pass
+
+
+def delay(ms):
+    board.advance(ms * 1000)
+
+
+def udelay(us):
+    board.advance(us)
+
+
+def millis():
+    return board.now // 1000
+
+
+def micros():
+    return board.now
+
+
+def elapsed_millis(start):
+    return millis() - start
+
+
+def elapsed_micros(start):
+    return micros() - start
+
+
+def freq():
+    return 168000000, 168000000, 42000000, 84000000
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
+
+
+def wfi():
+    board.advance(1)
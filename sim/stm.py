@@ -0,0 +1,76 @@
+"""
+Эмуляция модуля stm: прямой доступ к регистрам.
+Запись в ODR и BSRR портов GPIO переключает пины виртуальной платы,
+регистры TIMx_CCRn - это скважности каналов таймеров (запись через stm
+в журнал не попадает), остальные регистры просто хранят записанные значения.
+"""
+from .board import GPIO_BASE, GPIO_STEP, board
+
+GPIOA = GPIO_BASE
+GPIOB = GPIO_BASE + GPIO_STEP
+GPIOC = GPIO_BASE + 2 * GPIO_STEP
+GPIO_MODER = 0x00
+GPIO_IDR = 0x10
+GPIO_ODR = 0x14
+GPIO_BSRR = 0x18
+
+TIM2 = 0x40000000
+TIM3 = 0x40000400
+TIM4 = 0x40000800
+TIM5 = 0x40000c00
+TIM_CR1 = 0x00
+TIM_SR = 0x10
+TIM_EGR = 0x14
+TIM_CCR1 = 0x34
+TIM_CCR2 = 0x38
+TIM_CCR3 = 0x3c
+TIM_CCR4 = 0x40
+
+
+def _gpio(addr):
+    # (порт, смещение) для регистров GPIO, иначе None
+    port, offset = divmod(addr - GPIO_BASE, GPIO_STEP)
+    if 0 <= port < 3 and offset in (GPIO_IDR, GPIO_ODR, GPIO_BSRR, GPIO_BSRR + 2):
+        return port, offset
+    return None
+
+
+class _Mem:
+    def __init__(self, bits):
+        self._mask = (1 << bits) - 1
+        self._cells = board.memory  # board.reset() очищает его на месте
+
+    def __getitem__(self, addr):
+        if addr < GPIO_BASE:
+            return self._cells.get(addr, 0) & self._mask
+        reg = _gpio(addr)
+        if reg is not None:
+            port, offset = reg
+            if offset in (GPIO_IDR, GPIO_ODR):
+                return board.read_port(port)
+            return 0
+        return self._cells.get(addr, 0) & self._mask
+
+    def __setitem__(self, addr, value):
+        if addr < GPIO_BASE:
+            # Таймеры и остальная периферия ниже GPIO просто хранят значение,
+            # без журнала, чтобы эмуляция не заслоняла код драйверов в бенчмарках
+            self._cells[addr] = value & self._mask
+            return
+        value &= self._mask
+        reg = _gpio(addr)
+        if reg is None:
+            self._cells[addr] = value
+            return
+        port, offset = reg
+        if offset == GPIO_ODR:
+            board.write_port(port, value & 0xffff, ~value & 0xffff)
+        elif offset == GPIO_BSRR:
+            board.write_port(port, value & 0xffff, value >> 16)
+        elif offset == GPIO_BSRR + 2:
+            board.write_port(port, 0, value & 0xffff)
+
+
+mem8 = _Mem(8)
+mem16 = _Mem(16)
+mem32 = _Mem(32)
@@ -0,0 +1,44 @@
+"""
+Эмуляция модуля utime на виртуальных часах платы
+"""
+from .board import board
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = _TICKS_PERIOD // 2
+
+
+def ticks_us():
+    return board.now & _TICKS_MAX
+
+
+def ticks_ms():
+    return (board.now // 1000) & _TICKS_MAX
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
+
+
+def sleep(seconds):
+    board.advance(int(seconds * 1000000))
+
+
+def sleep_ms(ms):
+    board.advance(ms * 1000)
+
+
+def sleep_us(us):
+    board.advance(us)
+
+
+def time():
+    return board.now // 1000000
@@ -1,20 +1,150 @@
+from array import array
+from time import ticks_ms, ticks_diff
+
 from pyb import ADC
 from machine import Pin
+from micropython import schedule
+
+from pwm import timers
+from sampler import SampledADC
 
+_CACHE_FREQ = 10  # частота прерывания фонового обновления, Гц
 
-class Thermo(ADC):
+
+class Thermo(SampledADC, ADC):
     """
     Класс для более простой работы с термометром
+
+    Одиночное чтение АЦП заметно шумит. После set_oversampling() каждое
+    измерение заполняет заранее выделенный буфер отсчётами через read_timed
+    и усредняет их в целых числах; get_temps() возвращает несколько шкал
+    по одному такому измерению.
+
+    После set_cache() показания берутся из кэша, пока им не больше max_age_ms,
+    а фоновая задача на таймере обновляет кэш заранее. Счётчики hits и reads
+    показывают, сколько раз значение взято из кэша и сколько раз прочитан АЦП.
     """
+    _buf = None  # буфер отсчётов для усреднения, None - одиночное чтение
+    _timer = None  # таймер, задающий частоту отсчётов read_timed
+    _timer_id = 0
+    hits = 0  # показания, взятые из кэша
+    reads = 0  # измерения через АЦП
+    _max_age = 0  # срок жизни кэша в мс, 0 - кэш выключен
+    _cached = 0.0
+    _stamp = 0
+    _cache_timer = -1
+    _countdown = 0
+    _every = 0
+    _refresh_ref = None
+
     def __int__(self, pin: str):
         super(Thermo, self).__int__(Pin(pin, Pin.IN))
 
+    def set_oversampling(self, samples=16, freq=1000, timer=6) -> None:
+        """
+        Включает усреднение: каждое измерение состоит из samples отсчётов с частотой freq.
+        Измерение блокирует программу на samples / freq секунд, 16 мс по умолчанию.
+        :param samples: число отсчётов, 0 - вернуться к одиночному чтению
+        :param freq: частота отсчётов в герцах
+        :param timer: номер аппаратного таймера для read_timed
+        """
+        if self._timer is not None:
+            timers.stop_periodic(self._timer_id)
+            self._timer = None
+        if not samples:
+            self._buf = None
+            return
+        self._buf = array('H', [0] * samples)
+        self._timer_id = timer
+        self._timer = timers.reserve(timer, freq)
+
+    def set_cache(self, max_age_ms=1000, background=True, timer=14) -> None:
+        """
+        Включает кэш показаний.
+        :param max_age_ms: сколько мс показание считается свежим, 0 - выключить кэш
+        :param background: обновлять кэш в фоне каждые max_age_ms / 2,
+            чтобы get_temp почти никогда не ждал АЦП
+        :param timer: номер аппаратного таймера для фонового обновления
+        """
+        if self._cache_timer >= 0:
+            timers.stop_periodic(self._cache_timer)
+            self._cache_timer = -1
+        self._max_age = max_age_ms
+        self.hits = 0
+        self.reads = 0
+        if not max_age_ms:
+            return
+        self._refresh(None)
+        if background:
+            # _cache_tick передаёт метод в schedule() из прерывания, где получение
+            # self._refresh создавало бы новый связанный метод, то есть выделяло память
+            self._refresh_ref = self._refresh
+            self._every = max(1, max_age_ms * _CACHE_FREQ // 2000)
+            self._countdown = self._every
+            self._cache_timer = timer
+            timers.periodic(timer, _CACHE_FREQ, self._cache_tick)
+
+    def _cache_tick(self, t):
+        self._countdown -= 1
+        if self._countdown <= 0:
+            self._countdown = self._every
+            # Чтение АЦП с усреднением блокирует, поэтому не в прерывании
+            try:
+                schedule(self._refresh_ref, None)
+            except RuntimeError:
+                pass  # очередь schedule заполнена, обновим в следующий раз
+
+    def _refresh(self, arg):
+        self._cached = self._measure()
+        self._stamp = ticks_ms()
+
+    def _celsium(self) -> float:
+        if self._max_age:
+            if ticks_diff(ticks_ms(), self._stamp) < self._max_age:
+                self.hits += 1
+                return self._cached
+            self._refresh(None)
+            return self._cached
+        return self._measure()
+
+    def _measure(self) -> float:
+        self.reads += 1
+        buf = self._buf
+        sampler = self._sampler
+        if sampler is not None:
+            n = self._window
+            total = sampler.sum(self._channel, n)
+        elif buf is None:
+            return (3.3 / 2 ** 12) * self.read() * 100 - 50
+        else:
+            self.read_timed(buf, self._timer)
+            n = len(buf)
+            total = 0
+            for v in buf:
+                total += v
+        # Среднее с 4 дополнительными битами, затем сотые доли градуса:
+        # avg16 / 16 * 3300 / 4096 мВ, 10 мВ на градус, 500 мВ при 0 °C
+        avg16 = (total << 4) // n
+        return (avg16 * 4125 // 8192 - 5000) / 100
+
+    @staticmethod
+    def _scale(celsium: float, litera: str) -> float:
+        if litera == 'c' or litera == 'celsium':
+            return celsium
+        elif litera == 'k' or litera == 'kelvin':
+            return celsium + 273.15
+        elif litera == 'f' or litera == 'farenheit':
+            return (9 / 5) * celsium + 32
+        elif litera == 'r' or litera == 'reaumur':
+            return 8 * celsium / 10
+        raise ValueError('Unknown temperature scale ' + repr(litera))
+
     def get_temperature_in_celsium(self, digits=2) -> float:
         """
         Возвращает температуру по шкале Цельсия.
         :param digits: количество знаков после запятой, по-умолчанию 2
         """
-        celsium = (3.3 / 2 ** 12) * self.read() * 100 - 50
+        celsium = self._celsium()
         celsium = round(celsium, digits)
         return celsium
 
@@ -23,21 +153,21 @@ class Thermo(ADC):
         Возвращает температуру по шкале Кельвина
         :param digits: количество знаков после запятой, по-умолчанию 2
         """
-        return round(self.get_temperature_in_celsium(digits) + 273.15, digits)
+        return round(self._celsium() + 273.15, digits)
 
     def get_temperature_in_farenheit(self, digits=2) -> float:
         """
         Возвращает температуру по шкале Фаренгейта
         :param digits: количество знаков после запятой, по-умолчанию 2
         """
-        return round((9 / 5) * self.get_temperature_in_celsium() + 32, digits)
+        return round((9 / 5) * self._celsium() + 32, digits)
 
     def get_temperature_in_reaumur(self, digits=2) -> float:
         """
         Возвращает температуру по шкале Реомюра
         :param digits: количество знаков после запятой, по-умолчанию 2
         """
-        return round(8 * self.get_temperature_in_celsium() / 10, digits)
+        return round(8 * self._celsium() / 10, digits)
 
     def get_temp(self, litera='c', digits=2) -> float:
         """
@@ -53,3 +183,13 @@ class Thermo(ADC):
             return self.get_temperature_in_farenheit(digits)
         elif litera == 'r' or litera == 'reaumur':
             return self.get_temperature_in_reaumur(digits)
+
+    def get_temps(self, *literas, digits=2) -> tuple:
+        """
+        Возвращает температуру сразу по нескольким шкалам по одному измерению,
+        например get_temps('c', 'f')
+        :param literas: шкалы в том же виде, что и для get_temp
+        :param digits: количество знаков после запятой, по-умолчанию 2
+        """
+        celsium = self._celsium()
+        return tuple(round(self._scale(celsium, litera), digits) for litera in literas)
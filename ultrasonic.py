@@ -20,9 +20,12 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from time import sleep_us
+from array import array
+from time import sleep_us, ticks_us, ticks_ms, ticks_diff
 from machine import Pin, time_pulse_us
 
+from pwm import timers
+
 allowed_echo_pins = ('P8', 'P9', 'P10', 'P11', 'P12', 'P13')
 
 class MeasurementTimeout(Exception):
@@ -33,9 +36,42 @@ class MeasurementTimeout(Exception):
         super().__init__("Measurement timeout, exceeded {} us".format(timeout))
 
 
+_IDLE = 0
+_TRIGGERED = 1
+_ECHO = 2
+
+# Фильтры показаний, см. Ultrasonic.set_filter
+NO_FILTER = 0
+MEDIAN = 1
+EMA = 2
+
+_EMA_SHIFT = 8  # EMA хранится в мкс с 8 дробными битами
+
+US_PER_M = 5800  # время прохода звука до препятствия и обратно, мкс на метр (29 мкс/см * 2)
+_RANGE_MARGIN_US = 200  # запас к времени ожидания эха в set_range
+
+
+def us_per_m_at(celsius10: int) -> int:
+    """
+    Возвращает время прохода звука туда и обратно в мкс на метр
+    при температуре воздуха celsius10 в десятых долях градуса Цельсия.
+    Скорость звука 331.3 + 0.606 * T м/с, считается в см/с целыми числами.
+    """
+    return 200000000 // (33130 + 606 * celsius10 // 100)
+
+
 class Ultrasonic(object):
     """
     Класс для работы с ультразвуковым дальнометром HC-SR04
+
+    distance_in_cm() ждёт эхо, блокируя программу до timeout_us.
+    Без ожидания: ping() запускает измерение, фронты эха ловятся в прерывании,
+    а результат появляется в pulse_us и last_cm(), счётчик samples растёт
+    с каждым новым измерением.
+
+    После set_filter() каждое измерение с эхом попадает в кольцевой буфер,
+    а filtered_us() и filtered_cm() возвращают медиану или экспоненциальное
+    среднее; измерения без эха отбрасываются и считаются в rejected.
     """
     def __init__(self, trigger_pin, echo_pin, timeout_us=30000):
         # WARNING: Don't use PA4-X5 or PA5-X6 as echo pin without a 1k resistor
@@ -44,6 +80,12 @@ class Ultrasonic(object):
         # 400 cm * 29 us/cm (speed of sound ~340 m/s) * 2 (round-trip)
 
         self.timeout = timeout_us
+        self._timeout_us = timeout_us  # ожидание эха без set_range
+        self.max_mm = 0  # предел дальности из set_range, 0 - не задан
+        self.us_per_m = US_PER_M
+        self._thermo = None
+        self._refresh_ms = 0
+        self._thermo_ms = 0
 
         # Init trigger pin (out)
         self.trigger = Pin(trigger_pin, mode=Pin.OUT, pull=None)
@@ -55,6 +97,267 @@ class Ultrasonic(object):
             print('! Эхо-пины от P0 до P7 должны быть использованы с резистором на 1 кОм')
             print('  В противном случае показания будут некорректны')
 
+        self.samples = 0  # число измерений, завершённых в прерывании
+        self.pulse_us = -1  # длительность последнего эхо-импульса, -1 если эха не было
+        self.stamp_ms = 0  # ticks_ms() момента последнего измерения
+        self._state = _IDLE
+        self._rise = 0
+        self._handler = None
+        self.rejected = 0  # отброшенные фильтром измерения без эха
+        self._filter = NO_FILTER
+        self._ring = None  # последние длительности эха в мкс
+        self._sorted = None  # место для сортировки при поиске медианы
+        self._pos = 0
+        self._filled = 0
+        self._ema = 0
+        self._shift = 0
+
+    def set_filter(self, mode=MEDIAN, size=5, shift=2) -> None:
+        """
+        Включает фильтрацию показаний.
+        :param mode: MEDIAN - медиана последних size измерений,
+            EMA - экспоненциальное среднее с весом нового измерения 1/2**shift,
+            NO_FILTER - выключить
+        :param size: размер буфера для медианы
+        :param shift: сглаживание EMA, чем больше, тем плавнее и медленнее
+        """
+        self._filter = mode
+        if mode == MEDIAN:
+            self._ring = array('i', [0] * size)
+            self._sorted = array('i', [0] * size)
+        else:
+            self._ring = None
+            self._sorted = None
+        self._shift = shift
+        self._pos = 0
+        self._filled = 0
+        self._ema = 0
+
+    def _add(self, pulse):
+        # Вызывается и из прерывания, поэтому только целые числа и готовые массивы
+        if pulse < 0:
+            self.rejected += 1
+            return
+        if self._filter == MEDIAN:
+            ring = self._ring
+            pos = self._pos
+            ring[pos] = pulse
+            pos += 1
+            self._pos = 0 if pos == len(ring) else pos
+            if self._filled < len(ring):
+                self._filled += 1
+        else:
+            pulse <<= _EMA_SHIFT
+            if self._filled:
+                self._ema += (pulse - self._ema) >> self._shift
+            else:
+                self._ema = pulse
+                self._filled = 1
+
+    def filtered_us(self) -> int:
+        """
+        Возвращает отфильтрованную длительность эха в мкс, -1 если измерений с эхом ещё не было
+        """
+        n = self._filled
+        if not n:
+            return -1
+        if self._filter != MEDIAN:
+            return self._ema >> _EMA_SHIFT
+        ring = self._ring
+        buf = self._sorted
+        # Сортировка вставками в заранее выделенный массив
+        for i in range(n):
+            v = ring[i]
+            j = i
+            while j and buf[j - 1] > v:
+                buf[j] = buf[j - 1]
+                j -= 1
+            buf[j] = v
+        half = n >> 1
+        if n & 1:
+            return buf[half]
+        return (buf[half - 1] + buf[half]) >> 1
+
+    def filtered_cm(self) -> float:
+        """
+        Возвращает отфильтрованное расстояние в сантиметрах, -1 если измерений с эхом ещё не было
+        """
+        pulse = self.filtered_us()
+        if pulse < 0:
+            return -1
+        return pulse / self.us_per_m * 100
+
+    def ping(self) -> None:
+        """
+        Запускает измерение и сразу возвращается, не дожидаясь эха.
+        Результат появится в pulse_us и last_cm() после прихода эха.
+        """
+        self._arm()
+        self._expire()
+        self._compensate()
+        self._rise = ticks_us()  # до фронта эха - момент запуска, см. _expire
+        self._state = _TRIGGERED
+        self.trigger.on()
+        sleep_us(10)
+        self.trigger.off()
+
+    def _arm(self):
+        # Регистрация прерывания выделяет память, поэтому её нельзя делать в прерывании:
+        # SonarRing вызывает _arm() для всех датчиков заранее
+        if self._handler is None:
+            # Сохранённый обработчик отмечает, что прерывание уже зарегистрировано,
+            # поэтому повторные ping() не регистрируют его заново
+            self._handler = self._edge
+            self.echo.irq(handler=self._handler, trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING)
+
+    def _finish(self, pulse):
+        self.pulse_us = pulse
+        self.stamp_ms = ticks_ms()
+        self.samples += 1
+        self._state = _IDLE
+        if self._filter:
+            self._add(pulse)
+
+    def _edge(self, pin):
+        now = ticks_us()
+        state = self._state
+        if state == _TRIGGERED:
+            if pin.value():
+                self._rise = now
+                self._state = _ECHO
+        elif state == _ECHO:
+            width = ticks_diff(now, self._rise)
+            self._finish(width if width <= self.timeout else -1)
+
+    def _expire(self):
+        # Эхо не началось или не закончилось за timeout_us (например, датчик отключён):
+        # измерение завершается с -1, иначе busy() остался бы True навсегда
+        if self._state != _IDLE and ticks_diff(ticks_us(), self._rise) > self.timeout:
+            self._finish(-1)
+
+    def busy(self) -> bool:
+        """
+        Возвращает True, пока измерение, запущенное ping(), не завершилось
+        """
+        self._expire()
+        return self._state != _IDLE
+
+    def last_cm(self) -> float:
+        """
+        Возвращает расстояние в сантиметрах по последнему измерению ping(),
+        -1 если эха не было или измерений ещё не было.
+        """
+        pulse = self.pulse_us
+        if pulse < 0:
+            return -1
+        return pulse / self.us_per_m * 100
+
+    def deinit(self) -> None:
+        """
+        Отключает прерывание эхо-пина
+        """
+        self.echo.irq(handler=None)
+        self._handler = None
+        self._state = _IDLE
+
+    def set_thermometer(self, thermo, refresh_ms=5000) -> None:
+        """
+        Включает поправку скорости звука на температуру воздуха.
+        :param thermo: thermo.Thermo или другой ADC с датчиком TMP36, None - выключить поправку
+        :param refresh_ms: как часто перечитывать температуру; между чтениями
+            измерения используют сохранённый коэффициент и не обращаются к АЦП
+        """
+        self._thermo = thermo
+        self._refresh_ms = refresh_ms
+        if thermo is None:
+            self._set_us_per_m(US_PER_M)
+        else:
+            self._compensate(True)
+
+    def _compensate(self, force=False):
+        thermo = self._thermo
+        if thermo is None:
+            return
+        now = ticks_ms()
+        if not force and ticks_diff(now, self._thermo_ms) < self._refresh_ms:
+            return
+        self._thermo_ms = now
+        # TMP36: 10 мВ на градус, 500 мВ при 0 °C, то есть милливольты минус 500 - это десятые доли градуса
+        self._set_us_per_m(us_per_m_at(thermo.read() * 3300 // 4096 - 500))
+
+    def _set_us_per_m(self, us_per_m):
+        self.us_per_m = us_per_m
+        if self.max_mm:
+            self.timeout = self.max_mm * us_per_m // 1000 + _RANGE_MARGIN_US
+
+    def set_range(self, max_mm: int) -> None:
+        """
+        Ограничивает дальность измерений: время ожидания эха считается из max_mm,
+        поэтому при пустом диапазоне все измерения заканчиваются быстро,
+        например за 3 мс для 50 см вместо 30 мс.
+        Измерение, запущенное раньше, чем датчик закончил свой эхо-импульс
+        (до 38 мс, если препятствия нет совсем), сразу возвращает -1.
+        :param max_mm: предел дальности в мм, 0 или None - снять ограничение
+            и вернуть timeout_us из конструктора
+        """
+        if not max_mm:
+            self.max_mm = 0
+            self.timeout = self._timeout_us
+            return
+        self.max_mm = max_mm
+        self.timeout = max_mm * self.us_per_m // 1000 + _RANGE_MARGIN_US
+
+    def _measure(self) -> int:
+        self._compensate()
+        if self.echo.value():
+            # Эхо прошлого измерения, прерванного по set_range, ещё идёт: датчик не примет
+            # новый запуск, а time_pulse_us отсчитал бы хвост старого импульса
+            time_pulse = -1
+        else:
+            # Send a 10us pulse
+            self.trigger.on()
+            sleep_us(10)
+            self.trigger.off()
+
+            # Wait for the pulse and calc its duration
+            time_pulse = time_pulse_us(self.echo, 1, self.timeout)
+        if self._filter:
+            self._add(time_pulse)
+        return time_pulse
+
+    def range_us(self) -> int:
+        """
+        Возвращает длительность эха в мкс, -1 если в пределах дальности ничего нет.
+        Не выделяет память под float, результат можно перевести в to_mm, to_cm или to_inch10.
+        """
+        pulse = self._measure()
+        return pulse if pulse >= 0 else -1
+
+    def distance_in_mm(self) -> int:
+        """
+        Возвращает расстояние в миллиметрах целым числом, -1 если в пределах дальности ничего нет.
+        """
+        return self.to_mm(self.range_us())
+
+    def to_mm(self, pulse: int) -> int:
+        """
+        Переводит длительность эха в миллиметры, -1 остаётся -1
+        """
+        return pulse * 1000 // self.us_per_m if pulse >= 0 else -1
+
+    def to_cm(self, pulse: int) -> int:
+        """
+        Переводит длительность эха в целые сантиметры, -1 остаётся -1
+        """
+        return pulse * 100 // self.us_per_m if pulse >= 0 else -1
+
+    def to_inch10(self, pulse: int) -> int:
+        """
+        Переводит длительность эха в десятые доли дюйма, -1 остаётся -1
+        """
+        # Через миллиметры, чтобы произведение оставалось малым целым
+        return pulse * 1000 // self.us_per_m * 100 // 254 if pulse >= 0 else -1
+
     def distance_in_inches(self) -> float:
         """
         Возвращает расстояние в дюймах.
@@ -65,18 +368,82 @@ class Ultrasonic(object):
         """
         Возвращает расстояние в сантиметрах.
         """
-        # Send a 10us pulse
-        self.trigger.on()
-        sleep_us(10)
-        self.trigger.off()
-
-        # Wait for the pulse and calc its duration
-        time_pulse = time_pulse_us(self.echo, 1, self.timeout)
+        time_pulse = self._measure()
 
         if time_pulse < 0:
             print("Measurement timeout, exceeded {} us".format(self.timeout))
             # raise MeasurementTimeout(self.timeout)
 
-        # Divide the duration of the pulse by 2 (round-trip) and then divide it
-        # by 29 us/cm (speed of sound = ~340 m/s)
-        return (time_pulse / 2) / 29
\ No newline at end of file
+        # Divide the duration of the pulse by the round-trip time per cm:
+        # 58 us/cm (speed of sound = ~340 m/s) or the temperature-compensated value
+        return time_pulse / self.us_per_m * 100
+
+class SonarRing(object):
+    """
+    Опрос нескольких дальномеров по кругу в прерывании таймера.
+    Следующий датчик запускается только после того, как эхо предыдущего
+    пришло или истекло его время ожидания, и не раньше чем через gap_ms
+    после предыдущего запуска, поэтому датчики не ловят чужое эхо.
+    Соседние по направлению датчики лучше передавать не подряд,
+    например: левый, правый, передний.
+    Последние значения и моменты измерений хранятся в самих датчиках:
+    pulse_us, last_cm() и stamp_ms, см. также age_ms().
+    """
+    __slots__ = ['sensors', 'rate', 'gap_ms', '_timer', '_current', '_fired']
+
+    def __init__(self, *sensors: Ultrasonic, rate=40, gap_ms=60, timer=13):
+        """
+        :param sensors: датчики Ultrasonic в порядке опроса
+        :param rate: частота прерывания в герцах, не больше одного запуска на прерывание;
+            если эхо идёт дольше, чем 1/rate, очередной запуск откладывается
+        :param gap_ms: наименьший промежуток между запусками в мс, чтобы затихло
+            эхо от дальних препятствий, 60 мс по документации на HC-SR04
+        :param timer: номер аппаратного таймера для прерывания
+        """
+        self.sensors = sensors
+        self.rate = rate
+        self.gap_ms = gap_ms
+        self._current = len(sensors) - 1
+        self._fired = ticks_ms() - gap_ms
+        self._timer = timer
+        for s in sensors:
+            s._arm()
+        timers.periodic(timer, rate, self._tick)
+
+    def _tick(self, t):
+        sensors = self.sensors
+        s = sensors[self._current]
+        if s._state != _IDLE:
+            # Эхо ещё идёт; если датчик так и не ответил, измерение завершается с -1
+            s._expire()
+            if s._state != _IDLE:
+                return
+        now = ticks_ms()
+        if ticks_diff(now, self._fired) < self.gap_ms:
+            return
+        i = self._current + 1
+        if i == len(sensors):
+            i = 0
+        self._current = i
+        self._fired = now
+        sensors[i].ping()
+
+    def distance_cm(self, i: int) -> float:
+        """
+        Возвращает последнее расстояние в сантиметрах от датчика номер i
+        """
+        return self.sensors[i].last_cm()
+
+    def age_ms(self, i: int) -> int:
+        """
+        Возвращает, сколько миллисекунд назад обновилось значение датчика номер i
+        """
+        return ticks_diff(ticks_ms(), self.sensors[i].stamp_ms)
+
+    def deinit(self) -> None:
+        """
+        Останавливает опрос и отключает прерывания датчиков
+        """
+        timers.stop_periodic(self._timer)
+        for s in self.sensors:
+            s.deinit()